@@ -9,10 +9,19 @@ logging.basicConfig(level=logging.DEBUG)
 # Create the app
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key-change-in-production")
-app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
+# Runs behind exactly one trusted proxy (Render's load balancer), so the last
+# X-Forwarded-For entry is the client address used for rate limiting
+app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1)
 
 # Create downloads directory
 os.makedirs("downloads", exist_ok=True)
 
 # Import routes after app initialization
 import routes  # noqa: F401
+from health import health_monitor
+
+from watchlist import watch_list
+
+health_monitor.start_canary()
+if watch_list:
+    watch_list.start()
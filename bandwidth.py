@@ -0,0 +1,167 @@
+import os
+import threading
+import time
+import itertools
+from collections import deque
+
+# Global egress cap for served downloads in KB/s; 0 means unlimited
+EGRESS_LIMIT_KBPS = int(os.environ.get('EGRESS_LIMIT_KBPS', 0))
+STREAM_CHUNK_SIZE = 64 * 1024
+# Files below this size (and audio) are served in the high priority class
+SMALL_FILE_BYTES = int(os.environ.get('SMALL_FILE_MB', 25)) * 1024 * 1024
+
+PRIORITY_WEIGHTS = {
+    'high': 4,
+    'normal': 2,
+    'low': 1,
+}
+
+
+class _Stream:
+    def __init__(self, stream_id, name, priority, size, virtual_time):
+        self.id = stream_id
+        self.name = name
+        self.priority = priority
+        self.weight = PRIORITY_WEIGHTS[priority]
+        self.size = size
+        self.sent = 0
+        self.started_at = time.time()
+        self.finished_at = None
+        self.waited = 0.0
+        # Weighted bytes sent, used to pick who goes next under contention
+        self.virtual_time = virtual_time
+
+    def throughput(self):
+        elapsed = (self.finished_at or time.time()) - self.started_at
+        return self.sent / elapsed if elapsed > 0 else 0.0
+
+    def as_dict(self):
+        return {
+            'id': self.id,
+            'priority': self.priority,
+            'size': self.size,
+            'sent': self.sent,
+            'throughput_kbps': round(self.throughput() / 1024, 1),
+            'throttled_seconds': round(self.waited, 3)
+        }
+
+
+class BandwidthScheduler:
+    """Shares a global egress budget between active download streams
+
+    A token bucket enforces the global cap. When several streams are waiting
+    for tokens, the one with the least weighted bytes sent goes first, so
+    bandwidth is split by priority weight and a slow client that is not asking
+    for data does not hold back the others.
+    """
+
+    def __init__(self, limit_bytes_per_sec=EGRESS_LIMIT_KBPS * 1024, burst_seconds=0.25, history=100):
+        self.rate = limit_bytes_per_sec
+        self.capacity = max(STREAM_CHUNK_SIZE, self.rate * burst_seconds)
+        self._tokens = self.capacity
+        self._last_refill = time.monotonic()
+        self._cond = threading.Condition()
+        self._ids = itertools.count(1)
+        self._active = {}
+        self._waiting = set()
+        self._finished = deque(maxlen=history)
+        self._total_sent = 0
+
+    def classify(self, size, audio=False):
+        """Pick a priority class for a file about to be served"""
+        if audio or (size is not None and size < SMALL_FILE_BYTES):
+            return 'high'
+        return 'normal'
+
+    def open_stream(self, name, size=None, priority='normal'):
+        with self._cond:
+            # New streams start level with the least-served active stream so
+            # they neither starve the others nor get starved by them
+            start = min((s.virtual_time for s in self._active.values()), default=0.0)
+            stream = _Stream(next(self._ids), name, priority, size, start)
+            self._active[stream.id] = stream
+            return stream
+
+    def close_stream(self, stream):
+        with self._cond:
+            self._active.pop(stream.id, None)
+            self._waiting.discard(stream.id)
+            stream.finished_at = time.time()
+            self._finished.append(stream)
+            self._cond.notify_all()
+
+    def acquire(self, stream, nbytes):
+        """Block until stream may send nbytes under the global cap"""
+        began = time.monotonic()
+        with self._cond:
+            if self.rate > 0:
+                # A stream that sat idle (e.g. a slow client) does not bank
+                # credit; it rejoins level with the streams already waiting
+                waiting = [self._active[i].virtual_time for i in self._waiting if i in self._active]
+                if waiting:
+                    stream.virtual_time = max(stream.virtual_time, min(waiting))
+                self._waiting.add(stream.id)
+                try:
+                    while True:
+                        self._refill()
+                        if self._tokens > 0 and self._is_next(stream):
+                            # Tokens may go negative; later refills repay the debt
+                            self._tokens -= nbytes
+                            break
+                        deficit = nbytes if self._tokens > 0 else 1 - self._tokens
+                        self._cond.wait(timeout=min(deficit / self.rate, 0.5))
+                finally:
+                    self._waiting.discard(stream.id)
+                    self._cond.notify_all()
+                stream.waited += time.monotonic() - began
+            stream.sent += nbytes
+            stream.virtual_time += nbytes / stream.weight
+            self._total_sent += nbytes
+
+    def stream_iter(self, stream, chunks):
+        """Yield chunks from an iterator, paced by the scheduler"""
+        try:
+            for chunk in chunks:
+                self.acquire(stream, len(chunk))
+                yield chunk
+        finally:
+            # Closing the source stops any producer behind it (e.g. ffmpeg)
+            if hasattr(chunks, 'close'):
+                chunks.close()
+            self.close_stream(stream)
+
+    def stream_file(self, stream, path, chunk_size=STREAM_CHUNK_SIZE):
+        """Yield a file's contents in chunks paced by the scheduler"""
+        def read():
+            with open(path, 'rb') as f:
+                while True:
+                    chunk = f.read(chunk_size)
+                    if not chunk:
+                        break
+                    yield chunk
+
+        return self.stream_iter(stream, read())
+
+    def stats(self):
+        with self._cond:
+            active = [s.as_dict() for s in self._active.values()]
+            finished = [s.as_dict() for s in self._finished]
+            total_sent = self._total_sent
+        return {
+            'limit_kbps': round(self.rate / 1024, 1) if self.rate > 0 else None,
+            'total_sent': total_sent,
+            'active': active,
+            'recent': finished[-10:]
+        }
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def _is_next(self, stream):
+        waiting = [self._active[i] for i in self._waiting if i in self._active]
+        return all(stream.virtual_time <= other.virtual_time for other in waiting)
+
+
+bandwidth_scheduler = BandwidthScheduler()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Bandwidth scheduler benchmark
+Simulates fast and slow clients downloading at the same time under a global
+egress cap and prints the throughput each one received.
+"""
+
+import sys
+import threading
+import time
+
+from bandwidth import BandwidthScheduler
+
+CHUNK = 64 * 1024
+
+
+def client(scheduler, name, size, priority, client_kbps, results):
+    """Pull size bytes through the scheduler, limited by the client's own link speed"""
+    stream = scheduler.open_stream(name, size=size, priority=priority)
+    started = time.monotonic()
+    sent = 0
+    try:
+        while sent < size:
+            nbytes = min(CHUNK, size - sent)
+            scheduler.acquire(stream, nbytes)
+            sent += nbytes
+            # Time the client's own network needs to take the chunk
+            time.sleep(nbytes / (client_kbps * 1024))
+    finally:
+        scheduler.close_stream(stream)
+    results[name] = (sent, time.monotonic() - started)
+
+
+def run(limit_kbps, clients):
+    scheduler = BandwidthScheduler(limit_bytes_per_sec=limit_kbps * 1024)
+    results = {}
+    threads = [
+        threading.Thread(target=client, args=(scheduler, name, size, priority, speed, results))
+        for name, size, priority, speed in clients
+    ]
+    started = time.monotonic()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.monotonic() - started
+
+    cap = f"{limit_kbps} KB/s" if limit_kbps else 'unlimited'
+    print(f"\nGlobal cap: {cap}, wall time {elapsed:.2f}s")
+    print("-" * 60)
+    total = 0
+    for name, size, priority, speed in clients:
+        sent, took = results[name]
+        total += sent
+        print(f"{name:<12} {priority:<7} link {speed:>5} KB/s -> "
+              f"{sent / took / 1024:8.1f} KB/s over {took:.2f}s")
+    print(f"Aggregate: {total / elapsed / 1024:.1f} KB/s")
+
+
+def main():
+    limit_kbps = int(sys.argv[1]) if len(sys.argv) > 1 else 4096
+    mb = 1024 * 1024
+    clients = [
+        ('fast-1', 8 * mb, 'normal', 8192),
+        ('fast-2', 8 * mb, 'normal', 8192),
+        ('slow-1', 1 * mb, 'normal', 256),
+        ('audio-1', 3 * mb, 'high', 8192),
+    ]
+    print("Bandwidth Scheduler Benchmark")
+    print("=" * 60)
+    run(limit_kbps, clients)
+    run(0, clients)
+
+
+if __name__ == "__main__":
+    main()
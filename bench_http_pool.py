@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+HTTP connection pooling benchmark
+Starts a local HTTPS stand-in server with a self-signed certificate and
+compares a fresh connection per request against the shared pools, both for
+plain requests and through yt-dlp.
+"""
+
+import os
+import ssl
+import sys
+import time
+import shutil
+import tempfile
+import threading
+import subprocess
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import requests
+import urllib3
+import yt_dlp
+
+from http_pool import HTTPPool
+
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive
+    body = b'x' * 2048
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        pass
+
+
+class CountingServer(ThreadingHTTPServer):
+    daemon_threads = True
+    handshakes = 0
+
+    def get_request(self):
+        conn, addr = super().get_request()
+        type(self).handshakes += 1
+        return conn, addr
+
+
+def start_server(cert_dir):
+    cert = os.path.join(cert_dir, 'cert.pem')
+    key = os.path.join(cert_dir, 'key.pem')
+    subprocess.run(
+        ['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+         '-subj', '/CN=localhost', '-keyout', key, '-out', cert],
+        check=True, capture_output=True
+    )
+    server = CountingServer(('127.0.0.1', 0), StandInHandler)
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert, key)
+    server.socket = context.wrap_socket(server.socket, server_side=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def measure(label, count, fetch):
+    CountingServer.handshakes = 0
+    started = time.perf_counter()
+    for _ in range(count):
+        fetch()
+    elapsed = time.perf_counter() - started
+    print(f"{label:<32} {elapsed / count * 1000:7.2f} ms/request, "
+          f"{CountingServer.handshakes:4d} TLS handshakes for {count} requests")
+    return elapsed / count
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    cert_dir = tempfile.mkdtemp()
+    try:
+        server = start_server(cert_dir)
+        url = f"https://127.0.0.1:{server.server_address[1]}/media"
+        print("HTTP Connection Pooling Benchmark")
+        print("=" * 60)
+
+        def fresh_session():
+            with requests.Session() as session:
+                session.get(url, verify=False).content
+
+        pool = HTTPPool()
+        shared = pool.session()
+
+        def pooled_session():
+            shared.get(url, verify=False).content
+
+        ydl_opts = {'quiet': True, 'no_warnings': True, 'nocheckcertificate': True}
+
+        def ytdlp_request():
+            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                ydl.urlopen(url).read()
+
+        base = measure('requests, new session each', count, fresh_session)
+        pooled = measure('requests, shared pool', count, pooled_session)
+        ytdlp_base = measure('yt-dlp, default handler', count, ytdlp_request)
+        pool.install()
+        ytdlp_pooled = measure('yt-dlp, pooled handler', count, ytdlp_request)
+
+        print("-" * 60)
+        print(f"Saved per request: requests {(base - pooled) * 1000:.2f} ms, "
+              f"yt-dlp {(ytdlp_base - ytdlp_pooled) * 1000:.2f} ms")
+        print(f"Pool stats: {pool.stats()}")
+        server.shutdown()
+    finally:
+        shutil.rmtree(cert_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Priority scheduler load test
+Serves every request from a fixed pool of worker threads, like one gunicorn
+gthread worker, and saturates it with long downloads while searches keep
+arriving. Compares search latency, measured from arrival so time spent
+waiting for a free thread counts, under one shared pool of slots (every
+request waits its turn) against the priority scheduler.
+"""
+
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from scheduler import PriorityScheduler, Overloaded
+
+THREADS = 8
+SLOTS = 4
+RESERVED = 1
+SEARCH_SECONDS = 0.05
+DOWNLOAD_SECONDS = 1.5  # yt-dlp work, holding a slot
+STREAM_SECONDS = 1.0  # sending the finished file, holding only a thread
+SEARCH_RATE = 10  # per second
+
+
+class SharedPool:
+    """Baseline: a fixed number of slots handed out first come, first served"""
+
+    def __init__(self, slots):
+        self._semaphore = threading.Semaphore(slots)
+
+    def enter(self, lane_name):
+        pass
+
+    def leave(self, lane_name):
+        pass
+
+    @contextmanager
+    def slot(self, lane_name, deadline=None):
+        with self._semaphore:
+            yield
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+def run(name, pool, duration, downloaders):
+    stop = threading.Event()
+    search_times, counts = [], {'downloads': 0, 'shed_downloads': 0, 'shed_searches': 0}
+    lock = threading.Lock()
+    server = ThreadPoolExecutor(THREADS)
+
+    def download():
+        # Mirrors /download: admitted for the whole request, a slot while
+        # yt-dlp runs, then the file is streamed without one
+        pool.enter('bulk')
+        try:
+            with pool.slot('bulk'):
+                time.sleep(DOWNLOAD_SECONDS)
+            time.sleep(STREAM_SECONDS)
+        finally:
+            pool.leave('bulk')
+
+    def download_client():
+        while not stop.is_set():
+            try:
+                server.submit(download).result()
+                with lock:
+                    counts['downloads'] += 1
+            except Overloaded as e:
+                with lock:
+                    counts['shed_downloads'] += 1
+                time.sleep(e.retry_after / 25)
+
+    def search(arrived):
+        try:
+            with pool.slot('interactive'):
+                time.sleep(SEARCH_SECONDS)
+        except Overloaded:
+            with lock:
+                counts['shed_searches'] += 1
+            return
+        with lock:
+            search_times.append(time.monotonic() - arrived)
+
+    clients = [threading.Thread(target=download_client) for _ in range(downloaders)]
+    for t in clients:
+        t.start()
+    time.sleep(0.2)  # let the downloads take their threads first
+
+    searches = []
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        searches.append(server.submit(search, time.monotonic()))
+        time.sleep(1 / SEARCH_RATE)
+    # Stop new downloads so searches still queued behind them can drain
+    stop.set()
+    for t in clients:
+        t.join()
+    for f in searches:
+        f.result()
+    server.shutdown()
+
+    print(f"{name:<28} searches {len(search_times):>3}  "
+          f"p50 {percentile(search_times, 0.5) * 1000:7.1f} ms  "
+          f"p99 {percentile(search_times, 0.99) * 1000:7.1f} ms  "
+          f"downloads {counts['downloads']:>3} (shed {counts['shed_downloads']}, "
+          f"searches shed {counts['shed_searches']})")
+    return pool
+
+
+def main():
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 8
+    downloaders = THREADS * 2
+    print("Priority Scheduler Load Test")
+    print(f"{THREADS} server threads, {SLOTS} slots ({RESERVED} reserved for interactive), "
+          f"{downloaders} download clients, {SEARCH_RATE} searches/s for {duration:.0f}s")
+    print("=" * 100)
+    run('searches only', PriorityScheduler(SLOTS, RESERVED, threads=THREADS), duration, 0)
+    run('downloads, shared pool', SharedPool(SLOTS), duration, downloaders)
+    scheduler = run('downloads, priority lanes', PriorityScheduler(SLOTS, RESERVED, threads=THREADS),
+                    duration, downloaders)
+
+    print("\nScheduler metrics after the priority run:")
+    for lane, stats in scheduler.stats()['lanes'].items():
+        print(f"  {lane:<12} admitted {stats['admitted']:>4}  shed {stats['shed']:>4}  "
+              f"wait p50 {stats['wait_p50_ms']} ms  p99 {stats['wait_p99_ms']} ms")
+
+
+if __name__ == "__main__":
+    main()
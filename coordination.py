@@ -0,0 +1,404 @@
+import os
+import json
+import time
+import tempfile
+import threading
+import logging
+
+from sqlite_store import SQLiteStore
+
+try:
+    import redis
+except ImportError:  # only needed for COORDINATION_BACKEND=redis
+    redis = None
+
+# Shared state for all gunicorn workers: 'sqlite' (one host), 'redis'
+# (several hosts) or 'memory' (single process, mainly for development)
+COORDINATION_BACKEND = os.environ.get('COORDINATION_BACKEND', 'sqlite')
+COORDINATION_SQLITE_PATH = os.environ.get(
+    'COORDINATION_SQLITE_PATH', os.path.join(tempfile.gettempdir(), 'youtube_downloader_state.db')
+)
+COORDINATION_REDIS_URL = os.environ.get('COORDINATION_REDIS_URL', 'redis://localhost:6379/0')
+CACHE_MAX_ENTRIES = int(os.environ.get('VIDEO_INFO_CACHE_SIZE', 256))
+
+
+def _cache_namespace(key):
+    """Key prefix entries are counted under for the cache size limit"""
+    return key[:key.index(':') + 1] if ':' in key else ''
+
+
+class CoordinationBackend:
+    """State shared between workers: metadata cache, job registry, rate limits
+
+    Values are JSON-serializable. Every cache write gets a new generation
+    number, which callers can use as a cheap change marker. The cache size
+    limit applies per key namespace (the part before the first ':'), so e.g.
+    a run of failure entries can't evict video metadata.
+    """
+
+    def cache_get(self, key):
+        """Return (generation, value) for a fresh entry, or None"""
+        raise NotImplementedError
+
+    def cache_set(self, key, value, ttl):
+        """Store value for ttl seconds and return its generation"""
+        raise NotImplementedError
+
+    def cache_delete(self, key):
+        raise NotImplementedError
+
+    def cache_stats(self):
+        raise NotImplementedError
+
+    def register_job(self, key, value, ttl):
+        """Record an in-flight job; False if the key is already registered"""
+        raise NotImplementedError
+
+    def unregister_job(self, key):
+        raise NotImplementedError
+
+    def list_jobs(self):
+        """Return {key: value} for all unexpired jobs"""
+        raise NotImplementedError
+
+    def count_jobs(self):
+        """Number of unexpired jobs; cheap enough for health probes"""
+        raise NotImplementedError
+
+    def take_token(self, bucket, rate, capacity, cost=1):
+        """Token bucket check: True if cost tokens were available and taken
+
+        rate is in tokens per second, capacity is the bucket size.
+        """
+        raise NotImplementedError
+
+
+class MemoryBackend(CoordinationBackend):
+    """In-process backend; state is not shared between workers"""
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._cache = {}
+        self._jobs = {}
+        self._buckets = {}
+        self._generation = 0
+
+    def cache_get(self, key):
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry and entry[0] > time.time():
+                return entry[1], entry[2]
+        return None
+
+    def cache_set(self, key, value, ttl):
+        with self._lock:
+            now = time.time()
+            self._cache.pop(key, None)
+            namespace = _cache_namespace(key)
+            same = [k for k in self._cache if k.startswith(namespace)]
+            if len(same) >= self.max_entries:
+                # Drop expired entries first, then the oldest ones in the namespace
+                for k in [k for k, v in self._cache.items() if v[0] <= now]:
+                    del self._cache[k]
+                same = [k for k in self._cache if k.startswith(namespace)]
+                for k in same[:len(same) - self.max_entries + 1]:
+                    del self._cache[k]
+            self._generation += 1
+            self._cache[key] = (now + ttl, self._generation, value)
+            return self._generation
+
+    def cache_delete(self, key):
+        with self._lock:
+            self._cache.pop(key, None)
+
+    def cache_stats(self):
+        with self._lock:
+            now = time.time()
+            return {
+                'backend': 'memory',
+                'entries': len(self._cache),
+                'fresh': sum(1 for entry in self._cache.values() if entry[0] > now),
+                'generation': self._generation
+            }
+
+    def register_job(self, key, value, ttl):
+        with self._lock:
+            now = time.time()
+            # Jobs whose unregister never ran (e.g. a killed worker) expire here
+            for k in [k for k, (expires, _) in self._jobs.items() if expires <= now]:
+                del self._jobs[k]
+            if key in self._jobs:
+                return False
+            self._jobs[key] = (now + ttl, value)
+            return True
+
+    def unregister_job(self, key):
+        with self._lock:
+            self._jobs.pop(key, None)
+
+    def list_jobs(self):
+        with self._lock:
+            now = time.time()
+            return {k: v for k, (expires, v) in self._jobs.items() if expires > now}
+
+    def count_jobs(self):
+        with self._lock:
+            now = time.time()
+            return sum(1 for expires, _ in self._jobs.values() if expires > now)
+
+    def take_token(self, bucket, rate, capacity, cost=1):
+        with self._lock:
+            now = time.time()
+            tokens, updated = self._buckets.get(bucket, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[bucket] = (tokens, now)
+            # A bucket idle for capacity / rate seconds is full again, same as no entry
+            idle_before = now - capacity / rate
+            for k in [k for k, (_, updated) in self._buckets.items() if updated <= idle_before]:
+                del self._buckets[k]
+            return allowed
+
+
+class SQLiteBackend(SQLiteStore, CoordinationBackend):
+    """Backend in a WAL-mode SQLite file shared by all workers on one host"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS cache (
+            key TEXT PRIMARY KEY, value TEXT NOT NULL,
+            generation INTEGER NOT NULL, expires_at REAL NOT NULL);
+        CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires_at);
+        CREATE TABLE IF NOT EXISTS jobs (
+            key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL);
+        CREATE INDEX IF NOT EXISTS jobs_expires ON jobs (expires_at);
+        CREATE TABLE IF NOT EXISTS buckets (
+            key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL);
+        CREATE INDEX IF NOT EXISTS buckets_updated ON buckets (updated_at);
+        CREATE TABLE IF NOT EXISTS counters (
+            name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+    """
+
+    def __init__(self, path=COORDINATION_SQLITE_PATH, max_entries=CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        super().__init__(path)
+
+    def cache_get(self, key):
+        row = self._conn().execute(
+            'SELECT generation, value FROM cache WHERE key = ? AND expires_at > ?',
+            (key, time.time())
+        ).fetchone()
+        if row:
+            return row[0], json.loads(row[1])
+        return None
+
+    def cache_set(self, key, value, ttl):
+        payload = json.dumps(value)
+
+        def write(conn):
+            now = time.time()
+            conn.execute('INSERT OR IGNORE INTO counters (name, value) VALUES (?, 0)', ('generation',))
+            conn.execute('UPDATE counters SET value = value + 1 WHERE name = ?', ('generation',))
+            generation = conn.execute('SELECT value FROM counters WHERE name = ?', ('generation',)).fetchone()[0]
+            conn.execute('DELETE FROM cache WHERE expires_at <= ?', (now,))
+            conn.execute(
+                'INSERT OR REPLACE INTO cache (key, value, generation, expires_at) VALUES (?, ?, ?, ?)',
+                (key, payload, generation, now + ttl)
+            )
+            conn.execute(
+                'DELETE FROM cache WHERE key IN (SELECT key FROM cache WHERE key GLOB ? '
+                'ORDER BY expires_at DESC LIMIT -1 OFFSET ?)',
+                (_cache_namespace(key) + '*', self.max_entries)
+            )
+            return generation
+
+        return self._write(write)
+
+    def cache_delete(self, key):
+        self._conn().execute('DELETE FROM cache WHERE key = ?', (key,))
+
+    def cache_stats(self):
+        conn = self._conn()
+        entries, fresh = conn.execute(
+            'SELECT COUNT(*), COALESCE(SUM(expires_at > ?), 0) FROM cache', (time.time(),)
+        ).fetchone()
+        row = conn.execute('SELECT value FROM counters WHERE name = ?', ('generation',)).fetchone()
+        return {
+            'backend': 'sqlite',
+            'entries': entries,
+            'fresh': fresh,
+            'generation': row[0] if row else 0
+        }
+
+    def register_job(self, key, value, ttl):
+        payload = json.dumps(value)
+
+        def write(conn):
+            now = time.time()
+            # Jobs whose unregister never ran (e.g. a killed worker) expire here
+            conn.execute('DELETE FROM jobs WHERE expires_at <= ?', (now,))
+            cursor = conn.execute(
+                'INSERT OR IGNORE INTO jobs (key, value, expires_at) VALUES (?, ?, ?)',
+                (key, payload, now + ttl)
+            )
+            return cursor.rowcount == 1
+
+        return self._write(write)
+
+    def unregister_job(self, key):
+        self._conn().execute('DELETE FROM jobs WHERE key = ?', (key,))
+
+    def list_jobs(self):
+        rows = self._conn().execute(
+            'SELECT key, value FROM jobs WHERE expires_at > ?', (time.time(),)
+        ).fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+    def count_jobs(self):
+        return self._conn().execute('SELECT COUNT(*) FROM jobs WHERE expires_at > ?', (time.time(),)).fetchone()[0]
+
+    def take_token(self, bucket, rate, capacity, cost=1):
+        def write(conn):
+            now = time.time()
+            row = conn.execute('SELECT tokens, updated_at FROM buckets WHERE key = ?', (bucket,)).fetchone()
+            tokens = capacity if row is None else min(capacity, row[0] + (now - row[1]) * rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            conn.execute(
+                'INSERT OR REPLACE INTO buckets (key, tokens, updated_at) VALUES (?, ?, ?)',
+                (bucket, tokens, now)
+            )
+            # A bucket idle for capacity / rate seconds is full again, same as no row
+            conn.execute('DELETE FROM buckets WHERE updated_at <= ?', (now - capacity / rate,))
+            return allowed
+
+        return self._write(write)
+
+
+class RedisBackend(CoordinationBackend):
+    """Backend on a Redis-protocol server, shared by workers on every node
+
+    Pass client= to use an existing connection (e.g. a local stand-in server
+    or fakeredis instance). Cache and job keys are also kept in sorted sets
+    scored by expiry, so counts never need a scan of the keyspace.
+    """
+
+    PREFIX = 'ytdl:'
+
+    # Atomic token bucket: KEYS[1]=bucket, ARGV = rate, capacity, cost, now
+    TAKE_TOKEN_SCRIPT = """
+        local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+        local rate, capacity, cost, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+        local tokens = tonumber(state[1]) or capacity
+        local updated = tonumber(state[2]) or now
+        tokens = math.min(capacity, tokens + (now - updated) * rate)
+        local allowed = 0
+        if tokens >= cost then
+            tokens = tokens - cost
+            allowed = 1
+        end
+        redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated_at', now)
+        redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 60)
+        return allowed
+    """
+
+    def __init__(self, url=COORDINATION_REDIS_URL, client=None):
+        if client is None:
+            if redis is None:
+                raise RuntimeError("COORDINATION_BACKEND=redis requires the 'redis' package")
+            client = redis.Redis.from_url(url)
+            client.ping()
+        self.client = client
+        self._take_token = self.client.register_script(self.TAKE_TOKEN_SCRIPT)
+
+    def cache_get(self, key):
+        raw = self.client.get(self.PREFIX + 'cache:' + key)
+        if raw is None:
+            return None
+        entry = json.loads(raw)
+        return entry['generation'], entry['value']
+
+    def cache_set(self, key, value, ttl):
+        generation = self.client.incr(self.PREFIX + 'generation')
+        entry = json.dumps({'generation': generation, 'value': value})
+        now = time.time()
+        pipe = self.client.pipeline()
+        pipe.set(self.PREFIX + 'cache:' + key, entry, ex=max(1, int(ttl)))
+        pipe.zadd(self.PREFIX + 'cache_index', {key: now + max(1, int(ttl))})
+        pipe.zremrangebyscore(self.PREFIX + 'cache_index', '-inf', now)
+        pipe.execute()
+        return generation
+
+    def cache_delete(self, key):
+        pipe = self.client.pipeline()
+        pipe.delete(self.PREFIX + 'cache:' + key)
+        pipe.zrem(self.PREFIX + 'cache_index', key)
+        pipe.execute()
+
+    def cache_stats(self):
+        pipe = self.client.pipeline()
+        pipe.zremrangebyscore(self.PREFIX + 'cache_index', '-inf', time.time())
+        pipe.zcard(self.PREFIX + 'cache_index')
+        pipe.get(self.PREFIX + 'generation')
+        _, entries, generation = pipe.execute()
+        return {
+            'backend': 'redis',
+            'entries': entries,
+            'fresh': entries,  # Redis expires keys itself
+            'generation': int(generation or 0)
+        }
+
+    def register_job(self, key, value, ttl):
+        ttl = max(1, int(ttl))
+        if not self.client.set(self.PREFIX + 'job:' + key, json.dumps(value), ex=ttl, nx=True):
+            return False
+        self.client.zadd(self.PREFIX + 'job_index', {key: time.time() + ttl})
+        return True
+
+    def unregister_job(self, key):
+        pipe = self.client.pipeline()
+        pipe.delete(self.PREFIX + 'job:' + key)
+        pipe.zrem(self.PREFIX + 'job_index', key)
+        pipe.execute()
+
+    def list_jobs(self):
+        keys = self._live_jobs()
+        if not keys:
+            return {}
+        values = self.client.mget([self.PREFIX + 'job:' + key for key in keys])
+        return {key: json.loads(raw) for key, raw in zip(keys, values) if raw is not None}
+
+    def count_jobs(self):
+        pipe = self.client.pipeline()
+        pipe.zremrangebyscore(self.PREFIX + 'job_index', '-inf', time.time())
+        pipe.zcard(self.PREFIX + 'job_index')
+        return pipe.execute()[1]
+
+    def _live_jobs(self):
+        self.client.zremrangebyscore(self.PREFIX + 'job_index', '-inf', time.time())
+        keys = self.client.zrange(self.PREFIX + 'job_index', 0, -1)
+        return [key.decode('utf-8') if isinstance(key, bytes) else key for key in keys]
+
+    def take_token(self, bucket, rate, capacity, cost=1):
+        return bool(self._take_token(keys=[self.PREFIX + 'bucket:' + bucket], args=[rate, capacity, cost, time.time()]))
+
+
+def create_backend(name=COORDINATION_BACKEND):
+    """Build the configured backend, falling back to memory if it can't start"""
+    try:
+        if name == 'redis':
+            return RedisBackend()
+        if name == 'sqlite':
+            return SQLiteBackend()
+        if name == 'memory':
+            return MemoryBackend()
+        raise ValueError(f"Unknown coordination backend: {name}")
+    except Exception as e:
+        logging.error(f"Coordination backend '{name}' unavailable, using in-process state: {str(e)}")
+        return MemoryBackend()
+
+
+coordination = create_backend()
@@ -0,0 +1,88 @@
+import os
+
+UNAVAILABLE = 'unavailable'
+PRIVATE = 'private'
+REGION_BLOCKED = 'region_blocked'
+BOT_BLOCKED = 'bot_blocked'
+TRANSIENT = 'transient'
+UNKNOWN = 'unknown'
+
+# Failures no retry or fallback profile can fix
+PERMANENT_FAILURES = (UNAVAILABLE, PRIVATE, REGION_BLOCKED)
+
+# Seconds a failure is remembered. Bot blocks and transient errors back off:
+# the TTL doubles for each consecutive failure, up to the cap.
+FAILURE_TTLS = {
+    UNAVAILABLE: int(os.environ.get('FAILURE_TTL_UNAVAILABLE', 3600)),
+    PRIVATE: int(os.environ.get('FAILURE_TTL_PRIVATE', 1800)),
+    REGION_BLOCKED: int(os.environ.get('FAILURE_TTL_REGION_BLOCKED', 3600)),
+    BOT_BLOCKED: int(os.environ.get('FAILURE_TTL_BOT_BLOCKED', 60)),
+    TRANSIENT: int(os.environ.get('FAILURE_TTL_TRANSIENT', 10)),
+}
+BACKOFF_CAP = {
+    BOT_BLOCKED: 1800,
+    TRANSIENT: 300,
+}
+
+FAILURE_MESSAGES = {
+    UNAVAILABLE: 'This video is unavailable or has been removed.',
+    PRIVATE: 'This video is private or requires sign-in.',
+    REGION_BLOCKED: 'This video is not available in the server\'s region.',
+    BOT_BLOCKED: 'YouTube is blocking automated requests. Please try again later or use a different video.',
+    TRANSIENT: 'Could not reach YouTube. Please try again shortly.',
+}
+
+# Lower-cased message fragments, checked in order (the first match wins)
+_PATTERNS = (
+    (PRIVATE, ('private video', 'members-only', 'join this channel', 'sign in to confirm your age',
+               'age-restricted', 'requires payment')),
+    (REGION_BLOCKED, ('not made this video available in your country', 'not available in your country',
+                      'geo restrict', 'geo-restrict', 'blocked it in your country')),
+    # Before UNAVAILABLE: YouTube's session rate limit starts with "Video unavailable"
+    (BOT_BLOCKED, ("sign in to confirm you're not a bot", 'sign in to confirm you’re not a bot',
+                   "this content isn't available, try again later", 'rate-limited',
+                   'http error 429', 'too many requests', 'captcha')),
+    (UNAVAILABLE, ('video unavailable', 'this video is not available', 'has been removed',
+                   'account associated with this video has been terminated', 'this video does not exist',
+                   'incomplete youtube id', 'is not a valid url', 'unsupported url',
+                   'http error 404', 'http error 410')),
+    (TRANSIENT, ('timed out', 'timeout', 'connection reset', 'connection refused', 'connection aborted',
+                 'temporary failure in name resolution', 'name or service not known', 'network is unreachable',
+                 'remote end closed', 'http error 500', 'http error 502', 'http error 503', 'http error 504',
+                 'ssl', 'incompleteread', 'unable to download webpage')),
+)
+
+
+class ExtractionError(Exception):
+    """A classified extraction or download failure
+
+    str() gives the user-facing message; kind is one of the classes above.
+    """
+
+    def __init__(self, kind, message=None, detail=None):
+        super().__init__(message or FAILURE_MESSAGES.get(kind, 'Could not process this video.'))
+        self.kind = kind
+        self.detail = detail
+
+    @property
+    def permanent(self):
+        return self.kind in PERMANENT_FAILURES
+
+
+def classify_failure(error):
+    """Work out which failure class an exception (or message) belongs to"""
+    if isinstance(error, ExtractionError):
+        return error.kind
+    message = str(error).lower()
+    for kind, fragments in _PATTERNS:
+        if any(fragment in message for fragment in fragments):
+            return kind
+    return UNKNOWN
+
+
+def failure_ttl(kind, count=1):
+    """How long to remember a failure seen count times in a row"""
+    ttl = FAILURE_TTLS.get(kind, 0)
+    if kind in BACKOFF_CAP:
+        ttl = min(BACKOFF_CAP[kind], ttl * 2 ** (max(count, 1) - 1))
+    return ttl
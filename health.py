@@ -0,0 +1,134 @@
+import os
+import random
+import shutil
+import threading
+import time
+import logging
+from collections import deque
+
+import yt_dlp
+
+# Background canary extraction; 0 disables it. Keep this low - every run is
+# a real request to YouTube and counts towards bot detection.
+CANARY_INTERVAL = int(os.environ.get('HEALTH_CANARY_INTERVAL', 1800))
+CANARY_URL = os.environ.get('HEALTH_CANARY_URL', 'https://www.youtube.com/watch?v=BaW_jenozKc')
+
+# Concurrent requests one worker can serve (1 for sync workers, --threads for gthread)
+WORKER_CAPACITY = int(os.environ.get('WORKER_CAPACITY', 1))
+MIN_FREE_DISK_MB = int(os.environ.get('MIN_FREE_DISK_MB', 500))
+
+# Paths that are probes themselves and must not count as load
+PROBE_PATHS = ('/healthz', '/readyz')
+
+
+class HealthMonitor:
+    """Keeps the local state health probes report from, without network calls"""
+
+    def __init__(self, history=50):
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._in_flight_downloads = 0
+        self._extractions = deque(maxlen=history)
+        self._canary = {'status': 'disabled' if CANARY_INTERVAL <= 0 else 'pending',
+                        'last_run': None, 'last_success': None, 'error': None}
+        self._canary_thread = None
+
+    def request_started(self, path):
+        if path in PROBE_PATHS:
+            return
+        with self._lock:
+            self._in_flight += 1
+            if path == '/download':
+                self._in_flight_downloads += 1
+
+    def request_finished(self, path):
+        if path in PROBE_PATHS:
+            return
+        with self._lock:
+            self._in_flight = max(0, self._in_flight - 1)
+            if path == '/download':
+                self._in_flight_downloads = max(0, self._in_flight_downloads - 1)
+
+    def record_extraction(self, success):
+        """Record the outcome of a real or canary extraction"""
+        with self._lock:
+            self._extractions.append((time.time(), bool(success)))
+
+    def extraction_stats(self):
+        with self._lock:
+            results = list(self._extractions)
+        if not results:
+            return {'samples': 0, 'success_rate': None, 'last_at': None}
+        successes = sum(1 for _, ok in results if ok)
+        return {
+            'samples': len(results),
+            'success_rate': round(successes / len(results), 3),
+            'last_at': results[-1][0]
+        }
+
+    def disk_stats(self, path):
+        try:
+            usage = shutil.disk_usage(path)
+        except OSError as e:
+            return {'path': path, 'error': str(e), 'ok': False}
+        free_mb = usage.free // (1024 * 1024)
+        return {'path': path, 'free_mb': free_mb, 'ok': free_mb >= MIN_FREE_DISK_MB}
+
+    def load_stats(self):
+        with self._lock:
+            in_flight = self._in_flight
+            downloads = self._in_flight_downloads
+        return {
+            'in_flight': in_flight,
+            'in_flight_downloads': downloads,
+            'capacity': WORKER_CAPACITY,
+            'saturation': round(in_flight / WORKER_CAPACITY, 3) if WORKER_CAPACITY else None,
+            'ok': in_flight < WORKER_CAPACITY
+        }
+
+    def canary_status(self):
+        with self._lock:
+            return dict(self._canary)
+
+    def start_canary(self):
+        """Start the low-rate background canary once per process"""
+        if CANARY_INTERVAL <= 0 or self._canary_thread is not None:
+            return
+        self._canary_thread = threading.Thread(target=self._canary_loop, name='health-canary', daemon=True)
+        self._canary_thread.start()
+
+    def _canary_loop(self):
+        while True:
+            # Jitter so that several workers don't probe YouTube in lockstep
+            time.sleep(CANARY_INTERVAL * random.uniform(0.5, 1.5))
+            self.run_canary()
+
+    def run_canary(self):
+        """Run one lightweight flat extraction and record the outcome"""
+        ydl_opts = {
+            'quiet': True,
+            'no_warnings': True,
+            'extract_flat': True,
+        }
+        now = time.time()
+        try:
+            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                info = ydl.extract_info(CANARY_URL, download=False)
+            success = bool(info)
+            error = None if success else 'No information returned'
+        except Exception as e:
+            success = False
+            error = str(e)
+            logging.warning(f"Health canary failed: {error}")
+
+        self.record_extraction(success)
+        with self._lock:
+            self._canary['status'] = 'ok' if success else 'failing'
+            self._canary['last_run'] = now
+            self._canary['error'] = error
+            if success:
+                self._canary['last_success'] = now
+
+
+health_monitor = HealthMonitor()
@@ -0,0 +1,185 @@
+import os
+import socket
+import threading
+import time
+import logging
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Connection pool limits: distinct hosts kept, and connections kept per host
+HTTP_POOL_HOSTS = int(os.environ.get('HTTP_POOL_HOSTS', 20))
+HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', 10))
+# Seconds a DNS answer is reused; 0 disables the cache
+DNS_CACHE_TTL = int(os.environ.get('DNS_CACHE_TTL', 60))
+DNS_CACHE_SIZE = 512
+
+
+class _DNSCache:
+    """TTL cache in front of socket.getaddrinfo, shared by every HTTP client"""
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._resolve = None
+        self.hits = 0
+        self.misses = 0
+
+    def install(self):
+        if self._resolve is not None or self.ttl <= 0:
+            return
+        self._resolve = socket.getaddrinfo
+        socket.getaddrinfo = self.getaddrinfo
+
+    def getaddrinfo(self, *args, **kwargs):
+        key = (args, tuple(sorted(kwargs.items())))
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > now:
+                self.hits += 1
+                return entry[1]
+        result = self._resolve(*args, **kwargs)
+        with self._lock:
+            self.misses += 1
+            if len(self._entries) >= DNS_CACHE_SIZE:
+                self._entries.clear()
+            self._entries[key] = (now + self.ttl, result)
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {'enabled': self._resolve is not None, 'entries': len(self._entries),
+                    'hits': self.hits, 'misses': self.misses}
+
+
+class HTTPPool:
+    """Process-wide keep-alive connection pools
+
+    One requests session serves our own HTTP calls (e.g. muxer fetches), and
+    yt-dlp is given a request handler whose sessions all share pooled
+    adapters, so extraction and download requests reuse TCP+TLS connections
+    instead of opening new ones for every YoutubeDL instance.
+    """
+
+    def __init__(self, max_hosts=HTTP_POOL_HOSTS, max_per_host=HTTP_POOL_SIZE):
+        self.max_hosts = max_hosts
+        self.max_per_host = max_per_host
+        self._lock = threading.Lock()
+        self._session = None
+        # (verify, legacy_ssl, system certs, source_address, client cert) -> shared adapter
+        self._ytdlp_adapters = {}
+        self.dns_cache = _DNSCache(DNS_CACHE_TTL)
+        self.ytdlp_pooling = False
+
+    def session(self):
+        """The shared requests session for direct HTTP calls"""
+        with self._lock:
+            if self._session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=self.max_hosts, pool_maxsize=self.max_per_host)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                self._session = session
+            return self._session
+
+    def install(self):
+        """Enable the DNS cache and route yt-dlp through the shared pools"""
+        self.dns_cache.install()
+        if self.ytdlp_pooling:
+            return
+        try:
+            self._register_ytdlp_handler()
+            self.ytdlp_pooling = True
+        except Exception as e:
+            # yt-dlp internals moved; it keeps working with its own connections
+            logging.warning(f"Shared connection pooling for yt-dlp unavailable: {str(e)}")
+
+    def _ytdlp_adapter(self, handler, legacy_ssl_support):
+        from yt_dlp.networking._requests import RequestsHTTPAdapter
+        import urllib3
+
+        # Everything _make_sslcontext and the adapter depend on, with the
+        # handler's own default applied when legacy_ssl_support is None
+        if legacy_ssl_support is None:
+            legacy_ssl_support = handler.legacy_ssl_support
+        key = (handler.verify, legacy_ssl_support, handler.prefer_system_certs, handler.source_address,
+               tuple(sorted(handler._client_cert.items())))
+        with self._lock:
+            adapter = self._ytdlp_adapters.get(key)
+            if adapter is None:
+                adapter = RequestsHTTPAdapter(
+                    ssl_context=handler._make_sslcontext(legacy_ssl_support=legacy_ssl_support),
+                    source_address=handler.source_address,
+                    max_retries=urllib3.util.retry.Retry(False),
+                    pool_connections=self.max_hosts,
+                    pool_maxsize=self.max_per_host
+                )
+                self._ytdlp_adapters[key] = adapter
+            return adapter
+
+    def _register_ytdlp_handler(self):
+        import requests as requests_lib
+        from yt_dlp.networking.common import register_rh, register_preference
+        from yt_dlp.networking._requests import RequestsRH, RequestsSession
+
+        pool = self
+
+        class PooledRequestsRH(RequestsRH):
+            """yt-dlp's requests handler, with connections shared across instances"""
+
+            def _create_instance(self, cookiejar, legacy_ssl_support=None):
+                # Sessions stay per YoutubeDL (they hold its cookies); only the
+                # adapter, and with it the connection pool, is shared
+                session = RequestsSession()
+                adapter = pool._ytdlp_adapter(self, legacy_ssl_support)
+                session.adapters.clear()
+                session.headers = requests_lib.models.CaseInsensitiveDict()
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                session.cookies = cookiejar
+                session.trust_env = False
+                return session
+
+            def _close_instance(self, instance):
+                # Closing the session would close the shared pools
+                pass
+
+        register_rh(PooledRequestsRH)
+
+        @register_preference(PooledRequestsRH)
+        def pooled_preference(rh, request):
+            return 10
+
+    def stats(self):
+        with self._lock:
+            adapters = list(self._ytdlp_adapters.values())
+            if self._session is not None:
+                adapters.extend(self._session.adapters.values())
+        hosts = connections = requests_made = idle = 0
+        for adapter in set(adapters):
+            manager = adapter.poolmanager
+            for key in manager.pools.keys():
+                pool = manager.pools.get(key)
+                if pool is None:
+                    continue
+                hosts += 1
+                connections += pool.num_connections
+                requests_made += pool.num_requests
+                # urllib3 pre-fills the queue with None placeholders
+                idle += sum(1 for conn in list(pool.pool.queue) if conn) if pool.pool else 0
+        return {
+            'ytdlp_pooling': self.ytdlp_pooling,
+            'max_hosts': self.max_hosts,
+            'max_per_host': self.max_per_host,
+            'hosts': hosts,
+            'connections_opened': connections,
+            'requests': requests_made,
+            'reused': max(0, requests_made - connections),
+            'idle_connections': idle,
+            'dns': self.dns_cache.stats()
+        }
+
+
+http_pool = HTTPPool()
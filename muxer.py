@@ -0,0 +1,146 @@
+import os
+import shutil
+import logging
+import threading
+import subprocess
+from collections import deque
+
+from http_pool import http_pool
+
+FFMPEG_PATH = os.environ.get('FFMPEG_PATH') or shutil.which('ffmpeg')
+# Server-side muxing of separate video+audio streams; needs ffmpeg on PATH
+MUX_ENABLED = os.environ.get('MUX_ENABLED', '1') == '1'
+# YouTube throttles long single requests, so media is fetched in ranges
+FETCH_RANGE_SIZE = 10 * 1024 * 1024
+FETCH_CHUNK_SIZE = 256 * 1024
+OUTPUT_CHUNK_SIZE = 64 * 1024
+FETCH_TIMEOUT = 30
+
+
+def mux_available():
+    return MUX_ENABLED and bool(FFMPEG_PATH)
+
+
+class MuxError(Exception):
+    pass
+
+
+class StreamingMuxer:
+    """Mux a video-only and an audio-only stream into fragmented MP4 on the fly
+
+    Both inputs are fetched concurrently and written into ffmpeg through
+    pipes; ffmpeg copies the codecs (no re-encode) and writes fragmented MP4
+    to stdout, which can be sent to the client as soon as the first fragment
+    is ready. Nothing touches the disk.
+    """
+
+    def __init__(self, video_format, audio_format, session=None):
+        self.video_format = video_format
+        self.audio_format = audio_format
+        self.session = session or http_pool.session()
+        self._process = None
+        self._threads = []
+        self._stderr = deque(maxlen=20)
+        self._errors = []
+        self._closed = False
+
+    def iter_chunks(self, chunk_size=OUTPUT_CHUNK_SIZE):
+        """Start the pipeline and yield muxed output until it completes"""
+        video_read, video_write = os.pipe()
+        audio_read, audio_write = os.pipe()
+        command = [
+            FFMPEG_PATH, '-hide_banner', '-nostdin', '-loglevel', 'error',
+            '-i', f'pipe:{video_read}',
+            '-i', f'pipe:{audio_read}',
+            '-map', '0:v:0', '-map', '1:a:0',
+            '-c', 'copy',
+            '-f', 'mp4',
+            '-movflags', 'frag_keyframe+empty_moov+default_base_moof',
+            'pipe:1'
+        ]
+        try:
+            self._process = subprocess.Popen(
+                command,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                pass_fds=(video_read, audio_read)
+            )
+        except OSError as e:
+            for fd in (video_read, video_write, audio_read, audio_write):
+                os.close(fd)
+            raise MuxError(f"Could not start ffmpeg: {str(e)}")
+        finally:
+            # The child has its own copies of the read ends
+            if self._process is not None:
+                os.close(video_read)
+                os.close(audio_read)
+
+        self._start_thread(self._drain_stderr)
+        self._start_thread(self._feed, self.video_format, video_write)
+        self._start_thread(self._feed, self.audio_format, audio_write)
+
+        try:
+            while True:
+                chunk = self._process.stdout.read1(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+            returncode = self._process.wait()
+            if returncode != 0 or self._errors:
+                details = '; '.join(self._errors) or ' | '.join(self._stderr)
+                raise MuxError(f"Muxing failed (ffmpeg exit {returncode}): {details}")
+        finally:
+            self.close()
+
+    def close(self):
+        """Stop ffmpeg and the fetchers, e.g. when the client disconnects"""
+        if self._closed:
+            return
+        self._closed = True
+        if self._process is not None and self._process.poll() is None:
+            self._process.kill()
+            self._process.wait()
+        if self._process is not None:
+            self._process.stdout.close()
+        for thread in self._threads:
+            thread.join(timeout=5)
+
+    def _start_thread(self, target, *args):
+        thread = threading.Thread(target=target, args=args, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def _drain_stderr(self):
+        for line in self._process.stderr:
+            self._stderr.append(line.decode('utf-8', 'replace').strip())
+
+    def _feed(self, fmt, fd):
+        """Copy one media stream into ffmpeg, range by range"""
+        headers = dict(fmt.get('http_headers') or {})
+        total = fmt.get('filesize')
+        offset = 0
+        try:
+            with os.fdopen(fd, 'wb') as pipe:
+                while not self._closed and (total is None or offset < total):
+                    end = offset + FETCH_RANGE_SIZE - 1
+                    headers['Range'] = f'bytes={offset}-{end}'
+                    with self.session.get(fmt['url'], headers=headers, stream=True, timeout=FETCH_TIMEOUT) as response:
+                        if response.status_code == 416:
+                            break  # past the end of a stream of unknown size
+                        response.raise_for_status()
+                        received = 0
+                        for chunk in response.iter_content(FETCH_CHUNK_SIZE):
+                            pipe.write(chunk)
+                            received += len(chunk)
+                    offset += received
+                    if received < FETCH_RANGE_SIZE:
+                        break
+        except BrokenPipeError:
+            pass  # ffmpeg exited or the client went away
+        except Exception as e:
+            if not self._closed:
+                logging.error(f"Mux fetch failed for format {fmt.get('format_id')}: {str(e)}")
+                self._errors.append(str(e))
+                if self._process is not None and self._process.poll() is None:
+                    self._process.kill()
@@ -0,0 +1,157 @@
+import os
+import io
+import hmac
+import time
+import heapq
+import uuid
+import cProfile
+import pstats
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from flask import g, has_request_context
+
+# Requests carrying "X-Profile: <PROFILE_TOKEN>" are run under cProfile.
+# Profiling is disabled entirely while the token is unset.
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN', '')
+# Keep the N slowest requests of each interval with their stage timings; 0 disables
+SLOW_REQUEST_CAPTURE = int(os.environ.get('SLOW_REQUEST_CAPTURE', 10))
+SLOW_REQUEST_INTERVAL = int(os.environ.get('SLOW_REQUEST_INTERVAL', 300))
+MAX_STORED_PROFILES = 20
+PROFILE_LINES = 60
+
+
+@contextmanager
+def stage(name):
+    """Time a block as a named stage of the current request, if it is being captured"""
+    timings = g.get('stage_timings') if has_request_context() else None
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0.0) + time.perf_counter() - started
+
+
+class RequestProfiler:
+    """On-demand cProfile captures and a rolling list of the slowest requests"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Only one cProfile session at a time; concurrent ones skew each other
+        self._profile_lock = threading.Lock()
+        self._profiles = OrderedDict()
+        self._interval_start = time.time()
+        self._current = []
+        self._previous = []
+        self._seq = 0
+
+    def is_authorized(self, request):
+        """Admin check for profiling: the token in X-Profile or ?token="""
+        if not PROFILE_TOKEN:
+            return False
+        supplied = request.headers.get('X-Profile') or request.args.get('token') or ''
+        return hmac.compare_digest(supplied.encode(), PROFILE_TOKEN.encode())
+
+    def begin(self, request):
+        profile_requested = 'X-Profile' in request.headers and self.is_authorized(request)
+        if not SLOW_REQUEST_CAPTURE and not profile_requested:
+            return
+        g.stage_timings = {}
+        g.request_started = time.perf_counter()
+        if profile_requested and self._profile_lock.acquire(blocking=False):
+            g.profiler = cProfile.Profile()
+            g.profiler.enable()
+
+    def finish(self, request, response):
+        started = g.get('request_started')
+        if started is None:
+            return response
+        duration = time.perf_counter() - started
+
+        profile_id = None
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            self._profile_lock.release()
+            profile_id = self._store_profile(request, duration, profiler)
+            response.headers['X-Profile-Id'] = profile_id
+
+        if SLOW_REQUEST_CAPTURE:
+            stages = {name: round(seconds * 1000, 1) for name, seconds in g.stage_timings.items()}
+            self._record(duration, {
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+                'at': time.time(),
+                'duration_ms': round(duration * 1000, 1),
+                'stages_ms': stages,
+                'other_ms': round(duration * 1000 - sum(stages.values()), 1),
+                'profile_id': profile_id
+            })
+        return response
+
+    def report(self):
+        with self._lock:
+            self._roll_interval()
+            current = [entry for _, _, entry in sorted(self._current, reverse=True)]
+            previous = [entry for _, _, entry in sorted(self._previous, reverse=True)]
+            profiles = [
+                {'id': pid, 'path': p['path'], 'duration_ms': p['duration_ms'], 'at': p['at']}
+                for pid, p in self._profiles.items()
+            ]
+        return {
+            'interval_seconds': SLOW_REQUEST_INTERVAL,
+            'interval_started_at': self._interval_start,
+            'slowest': current,
+            'previous_interval': previous,
+            'profiles': profiles
+        }
+
+    def get_profile(self, profile_id):
+        with self._lock:
+            entry = self._profiles.get(profile_id)
+        return entry['text'] if entry else None
+
+    def _record(self, duration, entry):
+        with self._lock:
+            self._roll_interval()
+            self._seq += 1
+            item = (duration, self._seq, entry)
+            if len(self._current) < SLOW_REQUEST_CAPTURE:
+                heapq.heappush(self._current, item)
+            elif duration > self._current[0][0]:
+                heapq.heapreplace(self._current, item)
+
+    def _roll_interval(self):
+        now = time.time()
+        if now - self._interval_start >= SLOW_REQUEST_INTERVAL:
+            self._previous = self._current
+            self._current = []
+            self._interval_start = now
+
+    def _store_profile(self, request, duration, profiler):
+        out = io.StringIO()
+        out.write(f"{request.method} {request.path} took {duration * 1000:.1f} ms\n")
+        for name, seconds in sorted(g.stage_timings.items(), key=lambda item: -item[1]):
+            out.write(f"  stage {name}: {seconds * 1000:.1f} ms\n")
+        out.write("\n")
+        stats = pstats.Stats(profiler, stream=out)
+        stats.sort_stats('cumulative').print_stats(PROFILE_LINES)
+
+        profile_id = uuid.uuid4().hex[:12]
+        with self._lock:
+            self._profiles[profile_id] = {
+                'path': request.path,
+                'duration_ms': round(duration * 1000, 1),
+                'at': time.time(),
+                'text': out.getvalue()
+            }
+            while len(self._profiles) > MAX_STORED_PROFILES:
+                self._profiles.popitem(last=False)
+        return profile_id
+
+
+request_profiler = RequestProfiler()
@@ -0,0 +1,93 @@
+import gzip
+import hashlib
+import json
+from flask import request, Response
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+# Bodies smaller than this are not worth the CPU of compressing
+MIN_COMPRESS_SIZE = 512
+
+FORMAT_COLUMNS = ['format_id', 'ext', 'resolution', 'filesize', 'vcodec', 'acodec']
+
+
+def parse_fields(value):
+    """Parse a fields selector given as a list or a comma separated string"""
+    if not value:
+        return None
+    if isinstance(value, str):
+        value = value.split(',')
+    fields = [str(f).strip() for f in value if str(f).strip()]
+    return fields or None
+
+
+def wants_compact(value):
+    """Interpret the compact flag from a JSON body or query string"""
+    if isinstance(value, str):
+        return value.lower() in ('1', 'true', 'yes')
+    return bool(value)
+
+
+def project(item, fields):
+    """Keep only the requested top-level fields of a dict"""
+    if not fields:
+        return item
+    return {key: item[key] for key in fields if key in item}
+
+
+def to_columns(rows, columns):
+    """Turn a list of dicts into a columnar {'columns', 'rows'} structure"""
+    return {
+        'columns': list(columns),
+        'rows': [[row.get(column) for column in columns] for row in rows]
+    }
+
+
+def make_etag(*parts):
+    """Build an opaque ETag value from the given parts"""
+    raw = '|'.join(str(part) for part in parts)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:20]
+
+
+def is_not_modified(etag):
+    """Check whether the client already holds the representation for etag"""
+    return bool(etag) and request.if_none_match.contains_weak(etag)
+
+
+def not_modified(etag):
+    """Empty 304 response carrying the ETag"""
+    response = Response(status=304)
+    response.set_etag(etag, weak=True)
+    return response
+
+
+def json_response(payload, status=200, etag=None, hash_body=False):
+    """Serialize payload compactly, compressing it when the client allows
+
+    With hash_body the ETag is derived from the serialized body, for payloads
+    that have no cache generation of their own.
+    """
+    body = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    if etag is None and hash_body:
+        etag = hashlib.sha1(body).hexdigest()[:20]
+    if etag and is_not_modified(etag):
+        return not_modified(etag)
+
+    response = Response(body, status=status, mimetype='application/json')
+    response.vary.add('Accept-Encoding')
+
+    if len(body) >= MIN_COMPRESS_SIZE:
+        accepted = request.accept_encodings
+        if brotli is not None and accepted['br']:
+            response.set_data(brotli.compress(body, quality=5))
+            response.content_encoding = 'br'
+        elif accepted['gzip']:
+            response.set_data(gzip.compress(body, compresslevel=6))
+            response.content_encoding = 'gzip'
+
+    if etag:
+        response.set_etag(etag, weak=True)
+    return response
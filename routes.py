@@ -1,10 +1,132 @@
 import os
 import tempfile
-from flask import render_template, request, jsonify, send_file, flash, redirect, url_for
+import time
+import shutil
+import uuid
+from urllib.parse import quote
+from yt_dlp.utils import sanitize_filename
+from flask import render_template, request, jsonify, flash, redirect, url_for, Response, make_response
 from app import app
-from youtube_service import youtube_service
+from youtube_service import youtube_service, is_video_format
+from health import health_monitor
+from bandwidth import bandwidth_scheduler
+from coordination import coordination
+from http_pool import http_pool
+from profiling import request_profiler
+from watchlist import watch_list, normalize_watch_url, WATCH_FORMATS, WATCH_MAX_BACKFILL
+from muxer import StreamingMuxer, MuxError, mux_available
+from scheduler import Overloaded, service_scheduler
+from failures import ExtractionError, classify_failure, BOT_BLOCKED, UNAVAILABLE, PRIVATE, REGION_BLOCKED, UNKNOWN
+from responses import (
+    FORMAT_COLUMNS, parse_fields, wants_compact, project, to_columns,
+    make_etag, is_not_modified, not_modified, json_response
+)
 import logging
 
+MAX_SEARCH_RESULTS = 50
+
+# Per-client request budget for the endpoints that reach YouTube; 0 disables it
+RATE_LIMIT_PER_MINUTE = int(os.environ.get('RATE_LIMIT_PER_MINUTE', 0))
+RATE_LIMITED_PATHS = ('/search', '/video_info', '/download')
+DOWNLOAD_JOB_TTL = 1800
+
+FAILURE_STATUS = {
+    UNAVAILABLE: 404,
+    PRIVATE: 403,
+    REGION_BLOCKED: 403,
+    UNKNOWN: 500,
+}
+
+
+def _attachment_headers(filename, size=None):
+    """Download headers with an ASCII fallback and a UTF-8 filename"""
+    ascii_name = filename.encode('ascii', 'ignore').decode('ascii').replace('"', '') or 'download'
+    headers = {
+        'Content-Disposition': f"attachment; filename=\"{ascii_name}\"; filename*=UTF-8''{quote(filename)}"
+    }
+    if size is not None:
+        headers['Content-Length'] = str(size)
+    return headers
+
+
+def _failure_response(error):
+    """JSON error for a classified failure, with Retry-After when retrying may help"""
+    response = jsonify({'error': str(error), 'reason': error.kind})
+    response.status_code = FAILURE_STATUS.get(error.kind, 503)
+    retry_after = getattr(error, 'retry_after', None)
+    if retry_after and not error.permanent:
+        response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
+def _overloaded_response(error):
+    """503 for a request shed by the scheduler, so the client backs off and retries"""
+    response = jsonify({'error': str(error), 'reason': 'overloaded'})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+
+def _register_download(job_id, url, format_type):
+    """Record an in-flight download; the download goes ahead if the backend is unavailable"""
+    try:
+        coordination.register_job(f"download:{job_id}", {
+            'video_id': youtube_service.extract_video_id(url),
+            'format': format_type,
+            'started_at': time.time()
+        }, DOWNLOAD_JOB_TTL)
+    except Exception as e:
+        logging.warning(f"Download registry unavailable: {str(e)}")
+
+
+def _unregister_download(job_id):
+    try:
+        coordination.unregister_job(f"download:{job_id}")
+    except Exception as e:
+        logging.warning(f"Download registry unavailable: {str(e)}")
+
+
+def _request_option(data, name):
+    """Read an option from the JSON body, falling back to the query string"""
+    value = data.get(name)
+    if value is None:
+        value = request.args.get(name)
+    return value
+
+@app.before_request
+def track_request_start():
+    health_monitor.request_started(request.path)
+
+@app.before_request
+def enforce_rate_limit():
+    """Shared token bucket per client, so the limit holds across all workers"""
+    if RATE_LIMIT_PER_MINUTE <= 0 or request.path not in RATE_LIMITED_PATHS:
+        return None
+    bucket = f"client:{request.remote_addr}"
+    try:
+        allowed = coordination.take_token(bucket, RATE_LIMIT_PER_MINUTE / 60.0, RATE_LIMIT_PER_MINUTE)
+    except Exception as e:
+        logging.warning(f"Rate limiter unavailable: {str(e)}")
+        return None
+    if not allowed:
+        return jsonify({'error': 'Too many requests. Please wait a moment and try again.'}), 429
+    return None
+
+@app.before_request
+def start_profiling():
+    request_profiler.begin(request)
+
+@app.after_request
+def finish_profiling(response):
+    return request_profiler.finish(request, response)
+
+@app.after_request
+def track_request_end(response):
+    # Streamed downloads outlive the view; count them until the body is sent
+    path = request.path
+    response.call_on_close(lambda: health_monitor.request_finished(path))
+    return response
+
 @app.route('/')
 def index():
     # No database - no download history to show
@@ -13,12 +135,28 @@ def index():
 @app.route('/search', methods=['POST'])
 def search_videos():
     try:
-        query = request.json.get('query', '').strip()
+        data = request.get_json(silent=True) or {}
+        query = data.get('query', '').strip()
         if not query:
             return jsonify({'error': 'Search query is required'}), 400
         
-        results = youtube_service.search_videos(query)
-        return jsonify({'results': results})
+        fields = parse_fields(_request_option(data, 'fields'))
+        compact = wants_compact(_request_option(data, 'compact'))
+        try:
+            limit = int(_request_option(data, 'limit') or 20)
+        except (TypeError, ValueError):
+            return jsonify({'error': 'limit must be a number'}), 400
+        limit = max(1, min(limit, MAX_SEARCH_RESULTS))
+        
+        results = youtube_service.search_videos(query, max_results=limit)
+        if compact:
+            columns = fields or (list(results[0]) if results else [])
+            payload = {'results': to_columns(results, columns)}
+        else:
+            payload = {'results': [project(result, fields) for result in results]}
+        return json_response(payload, hash_body=True)
+    except Overloaded as e:
+        return _overloaded_response(e)
     except Exception as e:
         logging.error(f"Search error: {str(e)}")
         return jsonify({'error': 'Failed to search videos. Please try again.'}), 500
@@ -26,7 +164,8 @@ def search_videos():
 @app.route('/video_info', methods=['POST'])
 def get_video_info():
     try:
-        url = request.json.get('url', '').strip()
+        data = request.get_json(silent=True) or {}
+        url = data.get('url', '').strip()
         if not url:
             return jsonify({'error': 'URL is required'}), 400
         
@@ -34,11 +173,35 @@ def get_video_info():
         if 'youtube.com/watch' not in url and 'youtu.be/' not in url:
             return jsonify({'error': 'Please enter a valid YouTube URL'}), 400
         
+        fields = parse_fields(_request_option(data, 'fields'))
+        compact = wants_compact(_request_option(data, 'compact'))
+        
+        # The ETag identifies the cached metadata generation plus the requested
+        # shape, so a client re-polling a cached video gets an empty 304
+        video_id = youtube_service.extract_video_id(url)
+        generation = youtube_service.get_cache_generation(video_id) if video_id else None
+        if generation is not None:
+            etag = make_etag(video_id, generation, fields, compact)
+            if is_not_modified(etag):
+                return not_modified(etag)
+        
         info = youtube_service.get_video_info(url)
         if not info:
             return jsonify({'error': 'Could not extract video information. Please check the URL or try again later.'}), 400
         
-        return jsonify(info)
+        payload = dict(info)
+        if compact and payload.get('formats'):
+            payload['formats'] = to_columns(payload['formats'], FORMAT_COLUMNS)
+        payload = project(payload, fields)
+        
+        generation = youtube_service.get_cache_generation(video_id) if video_id else None
+        etag = make_etag(video_id, generation, fields, compact) if generation is not None else None
+        return json_response(payload, etag=etag)
+    except Overloaded as e:
+        return _overloaded_response(e)
+    except ExtractionError as e:
+        logging.error(f"Video info error ({e.kind}): {e.detail or str(e)}")
+        return _failure_response(e)
     except Exception as e:
         logging.error(f"Video info error: {str(e)}")
         return jsonify({'error': 'Failed to get video information. The video may be private, unavailable, or blocked.'}), 500
@@ -55,36 +218,245 @@ def download_video():
         if not url:
             return jsonify({'error': 'URL is required'}), 400
         
-        # Download directly and return file
-        file_path = youtube_service.download_video_direct(url, format_type, quality)
-        
-        if not file_path or not os.path.exists(file_path):
-            return jsonify({'error': 'Download failed'}), 500
-        
-        # Return the file directly
-        filename = os.path.basename(file_path)
-        
-        def remove_file(response):
-            try:
-                os.remove(file_path)
-            except Exception:
-                pass
-            return response
-        
-        return send_file(
-            file_path,
-            as_attachment=True,
-            download_name=filename,
-            mimetype='application/octet-stream'
-        )
+        # Count the request against the bulk lane until its response closes,
+        # so downloads queued, running or streaming can't take every thread
+        service_scheduler.enter('bulk')
+        try:
+            response = make_response(_download_response(url, format_type, quality))
+        except Exception:
+            service_scheduler.leave('bulk')
+            raise
+        response.call_on_close(lambda: service_scheduler.leave('bulk'))
+        return response
         
+    except Overloaded as e:
+        return _overloaded_response(e)
+    except ExtractionError as e:
+        logging.error(f"Download error ({e.kind}): {e.detail or str(e)}")
+        return _failure_response(e)
     except Exception as e:
         logging.error(f"Download error: {str(e)}")
         return jsonify({'error': 'Download failed. Please try again.'}), 500
 
+def _download_response(url, format_type, quality):
+    """Download url and build the streaming response for /download"""
+    # One bulk slot covers format selection and either the progressive
+    # download or, for a muxed stream, the whole response
+    service_scheduler.acquire('bulk')
+    slot_held = True
+    
+    # Register the job so every worker can see what is in flight
+    job_id = uuid.uuid4().hex
+    _register_download(job_id, url, format_type)
+    
+    try:
+        # Separate video+audio streams give higher resolutions than the
+        # progressive formats; mux them on the fly when ffmpeg is available
+        if is_video_format(format_type) and mux_available():
+            mux = youtube_service.get_mux_formats(url, quality, lane=None)
+            if mux:
+                try:
+                    response = _stream_muxed(mux, job_id)
+                    slot_held = False  # released when the response closes
+                    return response
+                except MuxError as e:
+                    # Nothing has been sent yet, so the progressive file can still be served
+                    logging.warning(f"Muxing failed before streaming, using progressive download: {str(e)}")
+        
+        # Download directly and return file
+        file_path = youtube_service.download_video_direct(url, format_type, quality, lane=None)
+    except Exception:
+        _unregister_download(job_id)
+        raise
+    finally:
+        if slot_held:
+            service_scheduler.release('bulk')
+    
+    if not file_path or not os.path.exists(file_path):
+        _unregister_download(job_id)
+        return jsonify({'error': 'Download failed'}), 500
+    
+    # Stream the file through the bandwidth scheduler so fast clients
+    # can't take the whole uplink, then clean up the temporary directory
+    filename = os.path.basename(file_path)
+    size = os.path.getsize(file_path)
+    stream = bandwidth_scheduler.open_stream(
+        filename, size=size, priority=bandwidth_scheduler.classify(size, audio=not is_video_format(format_type))
+    )
+    
+    def generate():
+        try:
+            yield from bandwidth_scheduler.stream_file(stream, file_path)
+        finally:
+            shutil.rmtree(os.path.dirname(file_path), ignore_errors=True)
+            _unregister_download(job_id)
+    
+    return Response(
+        generate(),
+        mimetype='application/octet-stream',
+        headers=_attachment_headers(filename, size)
+    )
+
+def _stream_muxed(mux, job_id):
+    """Send a fragmented MP4 muxed by ffmpeg while the source streams are fetched
+
+    The first chunk is read before the response is built, so a pipeline that
+    fails straight away (e.g. a 403 from the media host) raises MuxError
+    instead of sending an empty 200.
+    """
+    filename = f"{sanitize_filename(mux['title'])}.mp4"
+    muxer = StreamingMuxer(mux['video'], mux['audio'])
+    chunks = muxer.iter_chunks()
+    first = next(chunks, None)
+    if first is None:
+        raise MuxError("ffmpeg produced no output")
+    stream = bandwidth_scheduler.open_stream(filename, priority='normal')
+    
+    def muxed():
+        yield first
+        yield from chunks
+    
+    def generate():
+        try:
+            yield from bandwidth_scheduler.stream_iter(stream, muxed())
+        except MuxError as e:
+            # Headers are already sent, so the client just sees a short file
+            logging.error(f"Muxed download error: {str(e)}")
+        finally:
+            _unregister_download(job_id)
+    
+    response = Response(
+        generate(),
+        mimetype='video/mp4',
+        headers=_attachment_headers(filename)
+    )
+    # Closing the response stops ffmpeg even if the body was never started,
+    # and releases the caller's bulk slot, held while ffmpeg and the source
+    # fetches run
+    response.call_on_close(muxer.close)
+    response.call_on_close(lambda: service_scheduler.release('bulk'))
+    return response
+
+def _watch_api_error():
+    """Error response if the watch API is disabled or the caller lacks the admin token"""
+    if watch_list is None:
+        return jsonify({'error': 'Watch lists are disabled. Set WATCH_ENABLED=1 to use them.'}), 404
+    if not watch_list.is_authorized(request):
+        return jsonify({'error': 'Not found'}), 404
+    return None
+
+@app.route('/watches', methods=['GET'])
+def list_watches():
+    """Watched channels and playlists with their sync state"""
+    error = _watch_api_error()
+    if error:
+        return error
+    return jsonify({'watches': watch_list.list_watches()})
+
+@app.route('/watches', methods=['POST'])
+def add_watch():
+    """Start mirroring a channel or playlist"""
+    error = _watch_api_error()
+    if error:
+        return error
+    data = request.get_json(silent=True) or {}
+    url = normalize_watch_url(data.get('url'))
+    if not url:
+        return jsonify({'error': 'Please enter a YouTube channel or playlist URL'}), 400
+    format_type = data.get('format', 'mp4')
+    if format_type not in WATCH_FORMATS:
+        return jsonify({'error': f"format must be one of: {', '.join(WATCH_FORMATS)}"}), 400
+    try:
+        backfill = int(data.get('backfill', 0))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'backfill must be a number'}), 400
+    if not 0 <= backfill <= WATCH_MAX_BACKFILL:
+        return jsonify({'error': f'backfill must be between 0 and {WATCH_MAX_BACKFILL}'}), 400
+    
+    watch = watch_list.add_watch(url, format_type, data.get('quality', 'best'), backfill)
+    if watch is None:
+        return jsonify({'error': 'This channel or playlist is already watched'}), 409
+    return jsonify(watch), 201
+
+@app.route('/watches/<int:watch_id>', methods=['DELETE'])
+def remove_watch(watch_id):
+    error = _watch_api_error()
+    if error:
+        return error
+    if not watch_list.remove_watch(watch_id):
+        return jsonify({'error': 'Watch not found'}), 404
+    return jsonify({'status': 'removed'})
+
+@app.route('/watches/<int:watch_id>/sync', methods=['POST'])
+def sync_watch(watch_id):
+    """Check a watch for new videos on the next scheduler pass"""
+    error = _watch_api_error()
+    if error:
+        return error
+    if not watch_list.request_sync(watch_id):
+        return jsonify({'error': 'Watch not found'}), 404
+    return jsonify({'status': 'scheduled'}), 202
+
+@app.route('/watches/queue', methods=['GET'])
+def watch_queue():
+    """Videos queued or downloaded for watched channels"""
+    error = _watch_api_error()
+    if error:
+        return error
+    return jsonify({'queue': watch_list.list_queue(request.args.get('status'))})
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    """Liveness probe - the process is up and serving requests"""
+    return jsonify({'status': 'ok', 'uptime': round(time.time() - health_monitor.started_at, 1)})
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    """Readiness probe built only from local state, never calls YouTube"""
+    load = health_monitor.load_stats()
+    disk = health_monitor.disk_stats(tempfile.gettempdir())
+    ready = load['ok'] and disk['ok']
+    try:
+        jobs = {'downloads': coordination.count_jobs()}
+    except Exception as e:
+        jobs = {'error': str(e)}
+    return jsonify({
+        'status': 'ready' if ready else 'not_ready',
+        'load': load,
+        'disk': disk,
+        'cache': youtube_service.cache_stats(),
+        'jobs': jobs,
+        'http_pool': http_pool.stats(),
+        'scheduler': service_scheduler.stats(),
+        'extraction': health_monitor.extraction_stats(),
+        'canary': health_monitor.canary_status()
+    }), 200 if ready else 503
+
+@app.route('/bandwidth_stats', methods=['GET'])
+def bandwidth_stats():
+    """Per-stream throughput of downloads currently being served"""
+    return jsonify(bandwidth_scheduler.stats())
+
+@app.route('/profiles', methods=['GET'])
+def profiles():
+    """Slowest recent requests with stage timings, plus captured profiles (admin only)"""
+    if not request_profiler.is_authorized(request):
+        return jsonify({'error': 'Not found'}), 404
+    return jsonify(request_profiler.report())
+
+@app.route('/profiles/<profile_id>', methods=['GET'])
+def download_profile(profile_id):
+    """Download one captured cProfile report as text (admin only)"""
+    text = request_profiler.get_profile(profile_id) if request_profiler.is_authorized(request) else None
+    if text is None:
+        return jsonify({'error': 'Not found'}), 404
+    return Response(text, mimetype='text/plain', headers={
+        'Content-Disposition': f'attachment; filename="profile-{profile_id}.txt"'
+    })
+
 @app.route('/test_ytdlp', methods=['GET'])
 def test_ytdlp():
-    """Test endpoint to check yt-dlp functionality"""
+    """Test endpoint to check yt-dlp functionality (live request - not a health check)"""
     try:
         import yt_dlp
         # Use a less popular video that's less likely to trigger bot detection
@@ -112,7 +484,7 @@ def test_ytdlp():
         })
     except Exception as e:
         error_msg = str(e)
-        if "Sign in to confirm you're not a bot" in error_msg or "bot" in error_msg.lower():
+        if classify_failure(e) == BOT_BLOCKED:
             status_msg = "YouTube is blocking bot requests - this is expected in production"
         else:
             status_msg = "yt-dlp error occurred"
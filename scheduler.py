@@ -0,0 +1,223 @@
+import os
+import time
+import itertools
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+# Request threads per worker process; match gunicorn --threads
+SERVER_THREADS = int(os.environ.get('SERVER_THREADS', 8))
+# Concurrent yt-dlp/ffmpeg operations per worker process. Keep this below
+# SERVER_THREADS: files already downloaded are sent without a slot.
+SERVICE_SLOTS = int(os.environ.get('SERVICE_SLOTS', 4))
+# Slots only interactive work (search, video info) may use
+INTERACTIVE_RESERVED = int(os.environ.get('INTERACTIVE_RESERVED', 1))
+# How long bulk downloads may wait for a slot before being turned away
+BULK_QUEUE_DEADLINE = int(os.environ.get('BULK_QUEUE_DEADLINE', 30))
+# Waiting requests allowed in total before the lowest priority ones are shed
+MAX_WAITING = int(os.environ.get('MAX_WAITING', 32))
+
+
+class Overloaded(Exception):
+    """Raised when a request is shed instead of being given a slot"""
+
+    def __init__(self, lane, reason, retry_after=5):
+        super().__init__('The server is busy. Please try again shortly.')
+        self.lane = lane
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class _Lane:
+    def __init__(self, name, priority, uses_reserved, max_queue, deadline, max_active=None):
+        self.name = name
+        self.priority = priority
+        self.uses_reserved = uses_reserved
+        self.max_queue = max_queue
+        self.deadline = deadline
+        # Requests admitted with enter() at once: queued, running or streaming
+        self.max_active = max_active
+        self.active = 0
+        self.in_flight = 0
+        self.queued = 0
+        self.admitted = 0
+        self.shed = 0
+        self.waits = deque(maxlen=500)
+
+    def as_dict(self):
+        waits = sorted(self.waits)
+
+        def percentile(p):
+            return round(waits[min(len(waits) - 1, int(len(waits) * p))] * 1000, 1) if waits else None
+
+        return {
+            'priority': self.priority,
+            'uses_reserved': self.uses_reserved,
+            'active': self.active,
+            'max_active': self.max_active,
+            'in_flight': self.in_flight,
+            'queued': self.queued,
+            'admitted': self.admitted,
+            'shed': self.shed,
+            'wait_p50_ms': percentile(0.5),
+            'wait_p99_ms': percentile(0.99)
+        }
+
+
+class _Waiter:
+    def __init__(self, lane, seq, deadline):
+        self.lane = lane
+        self.seq = seq
+        self.deadline = deadline
+        self.enqueued_at = time.monotonic()
+        self.granted = False
+        self.shed_reason = None
+
+
+class PriorityScheduler:
+    """Admission control for yt-dlp work, split into priority lanes
+
+    Interactive work may use every slot, while bulk and background work are
+    kept out of the reserved ones, so a burst of downloads can never take the
+    last slots away from search. Waiting requests are granted highest
+    priority first, give up at their lane deadline, and under overload the
+    lowest priority waiters are shed to make room.
+
+    Slots alone don't protect the server threads: a download waiting for a
+    slot, or streaming its file afterwards, still ties up a thread. Bulk
+    requests are therefore also admitted with enter() for their whole
+    lifetime, and at most threads - slots of them are let in at once, so
+    search and health checks always find a free thread.
+    """
+
+    def __init__(self, slots=SERVICE_SLOTS, reserved=INTERACTIVE_RESERVED,
+                 bulk_deadline=BULK_QUEUE_DEADLINE, max_waiting=MAX_WAITING,
+                 threads=SERVER_THREADS):
+        self.slots = max(1, slots)
+        # Slots bulk and background work share; the rest stay free for interactive
+        self.shared_slots = max(1, self.slots - reserved)
+        self.max_waiting = max_waiting
+        bulk_active = max(1, threads - self.slots)
+        self.lanes = {
+            'interactive': _Lane('interactive', 3, True, max_waiting, 10),
+            'bulk': _Lane('bulk', 2, False, min(max_waiting, bulk_active), bulk_deadline, bulk_active),
+            'background': _Lane('background', 1, False, max_waiting, 600),
+        }
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._waiting = []
+        self._in_flight = 0
+
+    def enter(self, lane_name):
+        """Admit a request to lane_name until leave(); raises Overloaded if the lane is full"""
+        lane = self.lanes[lane_name]
+        with self._cond:
+            if lane.max_active is not None and lane.active >= lane.max_active:
+                lane.shed += 1
+                raise Overloaded(lane.name, 'threads')
+            lane.active += 1
+
+    def leave(self, lane_name):
+        with self._cond:
+            self.lanes[lane_name].active -= 1
+
+    def acquire(self, lane_name, deadline=None):
+        """Wait for a slot in lane_name; raises Overloaded if shed"""
+        lane = self.lanes[lane_name]
+        with self._cond:
+            waiter = _Waiter(lane, next(self._seq), time.monotonic() + (deadline or lane.deadline))
+            # Waiters of the same or higher priority go first
+            ahead = any(w.lane.priority >= lane.priority for w in self._waiting)
+            if not ahead and self._can_start(lane):
+                self._grant(waiter)
+                return
+            if lane.queued >= lane.max_queue or not self._make_room(lane):
+                lane.shed += 1
+                raise Overloaded(lane.name, 'queue_full')
+
+            self._waiting.append(waiter)
+            lane.queued += 1
+            self._dispatch()
+            while not waiter.granted and waiter.shed_reason is None:
+                remaining = waiter.deadline - time.monotonic()
+                if remaining <= 0:
+                    self._remove(waiter, 'deadline')
+                    break
+                self._cond.wait(remaining)
+            if not waiter.granted:
+                raise Overloaded(lane.name, waiter.shed_reason)
+
+    def release(self, lane_name):
+        with self._cond:
+            self.lanes[lane_name].in_flight -= 1
+            self._in_flight -= 1
+            self._dispatch()
+
+    @contextmanager
+    def slot(self, lane_name, deadline=None):
+        self.acquire(lane_name, deadline)
+        try:
+            yield
+        finally:
+            self.release(lane_name)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'slots': self.slots,
+                'shared_slots': self.shared_slots,
+                'in_flight': self._in_flight,
+                'waiting': len(self._waiting),
+                'lanes': {name: lane.as_dict() for name, lane in self.lanes.items()}
+            }
+
+    def _can_start(self, lane):
+        if self._in_flight >= self.slots:
+            return False
+        if lane.uses_reserved:
+            return True
+        shared = sum(l.in_flight for l in self.lanes.values() if not l.uses_reserved)
+        return shared < self.shared_slots
+
+    def _grant(self, waiter):
+        lane = waiter.lane
+        lane.in_flight += 1
+        lane.admitted += 1
+        lane.waits.append(time.monotonic() - waiter.enqueued_at)
+        self._in_flight += 1
+        waiter.granted = True
+
+    def _remove(self, waiter, reason):
+        self._waiting.remove(waiter)
+        waiter.lane.queued -= 1
+        waiter.lane.shed += 1
+        waiter.shed_reason = reason
+
+    def _make_room(self, lane):
+        """Shed the newest waiter of the lowest lower-priority lane if the queue is full"""
+        if len(self._waiting) < self.max_waiting:
+            return True
+        victims = [w for w in self._waiting if w.lane.priority < lane.priority]
+        if not victims:
+            return False
+        victim = min(victims, key=lambda w: (w.lane.priority, -w.seq))
+        self._remove(victim, 'shed')
+        self._cond.notify_all()
+        return True
+
+    def _dispatch(self):
+        """Hand free slots to waiters, highest priority and oldest first"""
+        granted = False
+        for waiter in sorted(self._waiting, key=lambda w: (-w.lane.priority, w.seq)):
+            if self._in_flight >= self.slots:
+                break
+            if self._can_start(waiter.lane):
+                self._waiting.remove(waiter)
+                waiter.lane.queued -= 1
+                self._grant(waiter)
+                granted = True
+        if granted:
+            self._cond.notify_all()
+
+
+service_scheduler = PriorityScheduler()
@@ -0,0 +1,47 @@
+import os
+import sqlite3
+import threading
+
+
+class SQLiteStore:
+    """Base for state kept in a WAL-mode SQLite file shared by all workers
+
+    Every thread gets its own connection in autocommit mode; write
+    transactions are opened explicitly with _write. Subclasses set SCHEMA,
+    which is applied when the store is created.
+    """
+
+    SCHEMA = ''
+    TIMEOUT = 5
+    ROW_FACTORY = None
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn().executescript(self.SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.TIMEOUT, isolation_level=None, check_same_thread=False)
+            if self.ROW_FACTORY is not None:
+                conn.row_factory = self.ROW_FACTORY
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _write(self, fn):
+        """Run fn(conn) inside an immediate (write-locked) transaction"""
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            result = fn(conn)
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        return result
@@ -0,0 +1,373 @@
+import os
+import hmac
+import json
+import time
+import random
+import shutil
+import sqlite3
+import logging
+import threading
+
+from urllib.parse import urlparse, parse_qs
+
+from yt_dlp.utils import sanitize_filename
+
+from failures import ExtractionError
+from scheduler import Overloaded
+from sqlite_store import SQLiteStore
+from youtube_service import youtube_service
+
+# Channel/playlist mirroring; the API and background scheduler are off unless enabled
+WATCH_ENABLED = os.environ.get('WATCH_ENABLED', '0') == '1'
+WATCH_DB_PATH = os.environ.get('WATCH_DB_PATH', os.path.join('instance', 'watchlist.db'))
+WATCH_DOWNLOAD_DIR = os.environ.get('WATCH_DOWNLOAD_DIR', 'downloads')
+WATCH_SYNC_INTERVAL = int(os.environ.get('WATCH_SYNC_INTERVAL', 3600))
+# Admin token for the /watches API; while unset the API answers 404
+WATCH_TOKEN = os.environ.get('WATCH_TOKEN', '')
+# Existing videos a new watch may fetch on its first sync
+WATCH_MAX_BACKFILL = int(os.environ.get('WATCH_MAX_BACKFILL', 20))
+WATCH_FORMATS = ('mp4', 'audio')
+# Downloads running at once across all workers
+WATCH_MAX_CONCURRENT = int(os.environ.get('WATCH_MAX_CONCURRENT', 1))
+# Random delay before each queued download, so they don't fire in bursts
+WATCH_DOWNLOAD_JITTER = int(os.environ.get('WATCH_DOWNLOAD_JITTER', 30))
+WATCH_POLL_INTERVAL = 15
+WATCH_MAX_ATTEMPTS = 5
+# A download claimed longer ago than this is assumed dead and re-queued
+WATCH_DOWNLOAD_TIMEOUT = 2 * 3600
+# Recently seen IDs kept as the sync cursor, in case the newest is deleted
+CURSOR_SIZE = 20
+# Playlists are listed in full on every sync; entries past this are ignored
+PLAYLIST_MAX_ENTRIES = 5000
+
+
+def normalize_watch_url(url):
+    """Return the URL to list for a channel or playlist, or None if unsupported"""
+    url = (url or '').strip()
+    if 'youtube.com/' not in url:
+        return None
+    playlist_id = parse_qs(urlparse(url).query).get('list')
+    if playlist_id:
+        return f"https://www.youtube.com/playlist?list={playlist_id[0]}"
+    for marker in ('/@', '/channel/', '/c/', '/user/'):
+        if marker in url:
+            base = url.split('?')[0].rstrip('/')
+            # The uploads tab lists newest first, which incremental sync relies on
+            if not base.endswith(('/videos', '/shorts', '/streams')):
+                base += '/videos'
+            return base
+    return None
+
+
+def is_playlist_url(url):
+    return 'list=' in url
+
+
+class WatchList(SQLiteStore):
+    """Watched channels/playlists, their sync cursors and the download queue
+
+    State lives in SQLite so cursors survive restarts and every gunicorn
+    worker can run the scheduler: syncs and downloads are claimed with
+    atomic updates, so each is done by exactly one worker.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS watches (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            url TEXT NOT NULL UNIQUE,
+            title TEXT,
+            format TEXT NOT NULL,
+            quality TEXT NOT NULL,
+            backfill INTEGER NOT NULL DEFAULT 0,
+            cursor TEXT,
+            next_sync_at REAL NOT NULL,
+            last_sync_at REAL,
+            last_error TEXT,
+            created_at REAL NOT NULL);
+        CREATE TABLE IF NOT EXISTS watch_queue (
+            video_id TEXT PRIMARY KEY,
+            watch_id INTEGER NOT NULL,
+            url TEXT NOT NULL,
+            title TEXT,
+            status TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            not_before REAL NOT NULL,
+            claimed_at REAL,
+            file_path TEXT,
+            error TEXT,
+            created_at REAL NOT NULL);
+        CREATE INDEX IF NOT EXISTS watch_queue_status ON watch_queue (status, not_before);
+    """
+    TIMEOUT = 10
+    ROW_FACTORY = sqlite3.Row
+
+    def __init__(self, service, path=WATCH_DB_PATH, download_dir=WATCH_DOWNLOAD_DIR):
+        self.service = service
+        self.download_dir = download_dir
+        self._threads = []
+        super().__init__(path)
+
+    # Watch management
+
+    def is_authorized(self, request):
+        """Admin check for the watch API: the token in X-Watch-Token or ?token="""
+        if not WATCH_TOKEN:
+            return False
+        supplied = request.headers.get('X-Watch-Token') or request.args.get('token') or ''
+        return hmac.compare_digest(supplied.encode(), WATCH_TOKEN.encode())
+
+    def add_watch(self, url, format_type='mp4', quality='best', backfill=0):
+        """Register a channel or playlist; the first sync happens right away"""
+        now = time.time()
+
+        def write(conn):
+            cursor = conn.execute(
+                'INSERT OR IGNORE INTO watches (url, format, quality, backfill, next_sync_at, created_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (url, format_type, quality, min(max(0, int(backfill)), WATCH_MAX_BACKFILL), now, now)
+            )
+            if cursor.rowcount == 0:
+                return None
+            return cursor.lastrowid
+
+        watch_id = self._write(write)
+        return self.get_watch(watch_id) if watch_id else None
+
+    def remove_watch(self, watch_id):
+        def write(conn):
+            conn.execute("DELETE FROM watch_queue WHERE watch_id = ? AND status = 'pending'", (watch_id,))
+            return conn.execute('DELETE FROM watches WHERE id = ?', (watch_id,)).rowcount == 1
+
+        return self._write(write)
+
+    def request_sync(self, watch_id):
+        """Make a watch due for sync on the next scheduler pass"""
+        cursor = self._conn().execute('UPDATE watches SET next_sync_at = 0 WHERE id = ?', (watch_id,))
+        return cursor.rowcount == 1
+
+    def get_watch(self, watch_id):
+        row = self._conn().execute('SELECT * FROM watches WHERE id = ?', (watch_id,)).fetchone()
+        return self._watch_dict(row) if row else None
+
+    def list_watches(self):
+        conn = self._conn()
+        counts = {}
+        for row in conn.execute('SELECT watch_id, status, COUNT(*) AS n FROM watch_queue GROUP BY watch_id, status'):
+            counts.setdefault(row['watch_id'], {})[row['status']] = row['n']
+        watches = []
+        for row in conn.execute('SELECT * FROM watches ORDER BY id'):
+            watch = self._watch_dict(row)
+            watch['queue'] = counts.get(row['id'], {})
+            watches.append(watch)
+        return watches
+
+    def list_queue(self, status=None, limit=100):
+        query = 'SELECT * FROM watch_queue'
+        params = []
+        if status:
+            query += ' WHERE status = ?'
+            params.append(status)
+        query += ' ORDER BY created_at DESC LIMIT ?'
+        params.append(limit)
+        return [dict(row) for row in self._conn().execute(query, params)]
+
+    def _watch_dict(self, row):
+        watch = dict(row)
+        watch['cursor'] = json.loads(watch['cursor']) if watch['cursor'] else []
+        return watch
+
+    # Scheduler
+
+    def start(self):
+        """Start the sync loop and download workers in this process"""
+        if self._threads:
+            return
+        targets = [self._sync_loop] + [self._download_loop] * max(1, WATCH_MAX_CONCURRENT)
+        for index, target in enumerate(targets):
+            thread = threading.Thread(target=target, name=f'watch-{index}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _sync_loop(self):
+        while True:
+            try:
+                while self.sync_due():
+                    pass
+            except Exception as e:
+                logging.error(f"Watch sync loop error: {str(e)}")
+            time.sleep(WATCH_POLL_INTERVAL * random.uniform(0.5, 1.5))
+
+    def _download_loop(self):
+        while True:
+            try:
+                while self.download_next():
+                    pass
+            except Exception as e:
+                logging.error(f"Watch download loop error: {str(e)}")
+            time.sleep(WATCH_POLL_INTERVAL * random.uniform(0.5, 1.5))
+
+    def sync_due(self):
+        """Claim and sync one due watch; False when none is due"""
+        now = time.time()
+        next_sync = now + WATCH_SYNC_INTERVAL * random.uniform(0.8, 1.2)
+
+        def claim(conn):
+            row = conn.execute(
+                'SELECT * FROM watches WHERE next_sync_at <= ? ORDER BY next_sync_at LIMIT 1', (now,)
+            ).fetchone()
+            if row:
+                conn.execute('UPDATE watches SET next_sync_at = ? WHERE id = ?', (next_sync, row['id']))
+            return row
+
+        row = self._write(claim)
+        if row is None:
+            return False
+        self.sync_watch(self._watch_dict(row))
+        return True
+
+    def sync_watch(self, watch):
+        """Fetch entries not seen before and queue them for download"""
+        try:
+            if is_playlist_url(watch['url']):
+                title, to_queue, new_cursor = self._list_playlist(watch)
+            else:
+                title, to_queue, new_cursor = self._list_channel(watch)
+        except Exception as e:
+            logging.error(f"Watch sync failed for {watch['url']}: {str(e)}")
+            self._conn().execute('UPDATE watches SET last_error = ? WHERE id = ?', (str(e), watch['id']))
+            return 0
+
+        now = time.time()
+
+        def write(conn):
+            queued = 0
+            for entry in to_queue:
+                queued += conn.execute(
+                    'INSERT OR IGNORE INTO watch_queue (video_id, watch_id, url, title, status, not_before, created_at) '
+                    "VALUES (?, ?, ?, ?, 'pending', ?, ?)",
+                    (entry['id'], watch['id'], entry['url'], entry['title'], now, now)
+                ).rowcount
+            conn.execute(
+                'UPDATE watches SET title = COALESCE(?, title), cursor = ?, last_sync_at = ?, last_error = NULL WHERE id = ?',
+                (title, json.dumps(new_cursor), now, watch['id'])
+            )
+            return queued
+
+        queued = self._write(write)
+        if queued:
+            logging.info(f"Watch {watch['url']}: queued {queued} new videos")
+        return queued
+
+    def _list_channel(self, watch):
+        """New uploads of a channel, oldest first, and the updated cursor
+
+        The uploads tab lists newest first, so listing stops at the first
+        video in the cursor and unchanged channels cost one page request.
+        """
+        cursor = watch['cursor']
+        if cursor:
+            title, entries, found = self.service.list_new_entries(watch['url'], known_ids=cursor)
+            if not found:
+                logging.warning(f"Watch cursor for {watch['url']} not found; queueing the {len(entries)} newest entries")
+            to_queue = entries
+        else:
+            # First sync: only take the requested backfill, not the whole channel
+            title, entries, found = self.service.list_new_entries(
+                watch['url'], max_entries=max(watch['backfill'], CURSOR_SIZE)
+            )
+            to_queue = entries[:watch['backfill']]
+        new_cursor = ([entry['id'] for entry in entries] + cursor)[:CURSOR_SIZE]
+        # Oldest first, so downloads follow upload order
+        return title, list(reversed(to_queue)), new_cursor
+
+    def _list_playlist(self, watch):
+        """Entries added to a playlist since the last sync, and the updated cursor
+
+        Playlists come in playlist order, and new videos are usually appended
+        at the end, so there is no point at which listing can stop. The flat
+        listing is cheap, so the whole playlist is listed and compared with
+        the IDs seen last time, which the cursor holds in full.
+        """
+        title, entries, _ = self.service.list_new_entries(watch['url'], max_entries=PLAYLIST_MAX_ENTRIES)
+        if watch['last_sync_at'] is None:
+            # First sync: the backfill is taken from the end, where videos are added
+            to_queue = entries[-watch['backfill']:] if watch['backfill'] else []
+        else:
+            seen = set(watch['cursor'])
+            to_queue = [entry for entry in entries if entry['id'] not in seen]
+        # An empty listing keeps the old cursor rather than re-queueing everything later
+        new_cursor = [entry['id'] for entry in entries] or watch['cursor']
+        return title, to_queue, new_cursor
+
+    def download_next(self):
+        """Claim and download one queued video, respecting the global cap"""
+        now = time.time()
+
+        def claim(conn):
+            conn.execute(
+                "UPDATE watch_queue SET status = 'pending' WHERE status = 'downloading' AND claimed_at < ?",
+                (now - WATCH_DOWNLOAD_TIMEOUT,)
+            )
+            running = conn.execute("SELECT COUNT(*) FROM watch_queue WHERE status = 'downloading'").fetchone()[0]
+            if running >= WATCH_MAX_CONCURRENT:
+                return None
+            row = conn.execute(
+                'SELECT q.*, w.format, w.quality, w.title AS watch_title FROM watch_queue q '
+                'JOIN watches w ON w.id = q.watch_id '
+                "WHERE q.status = 'pending' AND q.not_before <= ? ORDER BY q.created_at LIMIT 1",
+                (now,)
+            ).fetchone()
+            if row:
+                conn.execute(
+                    "UPDATE watch_queue SET status = 'downloading', claimed_at = ?, attempts = attempts + 1 "
+                    'WHERE video_id = ?',
+                    (now, row['video_id'])
+                )
+            return row
+
+        row = self._write(claim)
+        if row is None:
+            return False
+
+        time.sleep(random.uniform(0, WATCH_DOWNLOAD_JITTER))
+        try:
+            temp_path = self.service.download_video_direct(row['url'], row['format'], row['quality'], lane='background')
+            folder = os.path.join(self.download_dir, sanitize_filename(row['watch_title'] or f"watch-{row['watch_id']}"))
+            os.makedirs(folder, exist_ok=True)
+            file_path = os.path.join(folder, os.path.basename(temp_path))
+            shutil.move(temp_path, file_path)
+            shutil.rmtree(os.path.dirname(temp_path), ignore_errors=True)
+        except Overloaded as e:
+            # Shed in favour of user requests; not the video's fault, so the attempt is refunded
+            self._conn().execute(
+                "UPDATE watch_queue SET status = 'pending', not_before = ?, attempts = attempts - 1 WHERE video_id = ?",
+                (time.time() + e.retry_after, row['video_id'])
+            )
+            return False
+        except Exception as e:
+            self._download_failed(row, e)
+            return True
+
+        self._conn().execute(
+            "UPDATE watch_queue SET status = 'done', file_path = ?, error = NULL WHERE video_id = ?",
+            (file_path, row['video_id'])
+        )
+        logging.info(f"Watch download finished: {file_path}")
+        return True
+
+    def _download_failed(self, row, error):
+        attempts = row['attempts'] + 1
+        permanent = isinstance(error, ExtractionError) and error.permanent
+        if permanent or attempts >= WATCH_MAX_ATTEMPTS:
+            status, not_before = 'failed', time.time()
+        else:
+            delay = getattr(error, 'retry_after', None) or 60 * 2 ** attempts
+            status, not_before = 'pending', time.time() + delay
+        logging.error(f"Watch download of {row['url']} failed ({status}): {str(error)}")
+        self._conn().execute(
+            'UPDATE watch_queue SET status = ?, not_before = ?, error = ? WHERE video_id = ?',
+            (status, not_before, str(error), row['video_id'])
+        )
+
+
+watch_list = WatchList(youtube_service) if WATCH_ENABLED else None
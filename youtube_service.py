@@ -2,14 +2,49 @@ import os
 import yt_dlp
 import re
 import tempfile
+import shutil
 import logging
+import time
+from contextlib import nullcontext
+from health import health_monitor
+from coordination import coordination
+from profiling import stage
+from http_pool import http_pool
+from scheduler import service_scheduler
+from failures import ExtractionError, classify_failure, failure_ttl, FAILURE_TTLS, PERMANENT_FAILURES, UNKNOWN
+
+# How long extracted video metadata is reused before asking YouTube again
+VIDEO_INFO_CACHE_TTL = int(os.environ.get('VIDEO_INFO_CACHE_TTL', 300))
+
+# Keep-alive connections and cached DNS shared by every YoutubeDL instance
+http_pool.install()
+
+VIDEO_ID_PATTERN = re.compile(r'(?:v=|youtu\.be/|/shorts/|/embed/)([A-Za-z0-9_-]{11})')
+
+# Download formats meaning an MP4 with video and audio ('video' is what the UI
+# sends); any other format is an audio-only download
+VIDEO_FORMATS = ('mp4', 'video')
+
+
+def is_video_format(format_type):
+    return format_type in VIDEO_FORMATS
+
 
 class YouTubeService:
     def __init__(self):
         self.downloads_dir = tempfile.mkdtemp()  # Temporary directory
         os.makedirs(self.downloads_dir, exist_ok=True)
+        # Metadata cache shared by all workers (see coordination.py)
+        self.coordination = coordination
+        # Admission control between interactive and bulk work (see scheduler.py)
+        self.scheduler = service_scheduler
     
     def search_videos(self, query, max_results=20):
+        """Search for YouTube videos in an interactive slot; raises Overloaded if shed"""
+        with self.scheduler.slot('interactive'):
+            return self._search_videos(query, max_results)
+    
+    def _search_videos(self, query, max_results=20):
         """Search for YouTube videos"""
         try:
             ydl_opts = {
@@ -19,10 +54,11 @@ class YouTubeService:
             }
             
             with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                search_results = ydl.extract_info(
-                    f"ytsearch{max_results}:{query}",
-                    download=False
-                )
+                with stage('search'):
+                    search_results = ydl.extract_info(
+                        f"ytsearch{max_results}:{query}",
+                        download=False
+                    )
                 
                 results = []
                 if search_results and 'entries' in search_results:
@@ -44,7 +80,163 @@ class YouTubeService:
             logging.error(f"Search error: {str(e)}")
             return []
     
+    def list_new_entries(self, url, known_ids=(), max_entries=200):
+        """List a channel's or playlist's entries in listing order, stopping at a known video
+
+        Channel uploads come newest first; playlists come in playlist order.
+        Entries are pulled lazily from the extractor, so continuation pages
+        beyond the first known ID are never fetched. Returns (title, entries,
+        found) where found tells whether a known ID was reached.
+        """
+        ydl_opts = {
+            'quiet': True,
+            'no_warnings': True,
+            'extract_flat': 'in_playlist',
+            'lazy_playlist': True,
+        }
+        known = set(known_ids)
+        entries = []
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            with stage('watch.list'):
+                result = ydl.extract_info(url, download=False, process=False)
+                # A channel URL may resolve to its uploads tab first
+                while result and result.get('_type') in ('url', 'url_transparent'):
+                    result = ydl.extract_info(result['url'], download=False, process=False)
+                if not result:
+                    return None, [], False
+                for entry in result.get('entries') or []:
+                    if not entry or not entry.get('id'):
+                        continue
+                    if entry['id'] in known:
+                        return result.get('title'), entries, True
+                    entries.append({
+                        'id': entry['id'],
+                        'title': entry.get('title', 'Unknown Title'),
+                        'url': f"https://www.youtube.com/watch?v={entry['id']}"
+                    })
+                    if len(entries) >= max_entries:
+                        break
+        return result.get('title'), entries, False
+
+    def extract_video_id(self, url):
+        """Return the 11 character YouTube video ID from a URL, or None"""
+        match = VIDEO_ID_PATTERN.search(url or '')
+        return match.group(1) if match else None
+
+    def get_cache_generation(self, video_id):
+        """Return the generation of the fresh cache entry for a video, or None"""
+        entry = self._cache_lookup(video_id)
+        return entry[0] if entry else None
+
     def get_video_info(self, url):
+        """Get video information, reusing cached metadata while it is fresh"""
+        video_id = self.extract_video_id(url)
+        entry = self._cache_lookup(video_id) if video_id else None
+        if entry:
+            return entry[1]
+
+        previous_failure = self._check_known_failure(video_id)
+        with self.scheduler.slot('interactive'):
+            try:
+                info = self._extract_video_info(url)
+            except ExtractionError as e:
+                if not e.permanent:
+                    health_monitor.record_extraction(False)
+                self._remember_failure(video_id, e, previous_failure)
+                raise
+            except Exception:
+                health_monitor.record_extraction(False)
+                raise
+        health_monitor.record_extraction(bool(info))
+        if info and video_id:
+            try:
+                self.coordination.cache_set(f"info:{video_id}", info, VIDEO_INFO_CACHE_TTL)
+                if previous_failure:
+                    self.coordination.cache_delete(f"fail:{video_id}")
+            except Exception as e:
+                logging.warning(f"Could not cache video info: {str(e)}")
+        return info
+
+    def cache_stats(self):
+        """Summarize the metadata cache for health reporting"""
+        try:
+            return self.coordination.cache_stats()
+        except Exception as e:
+            return {'error': str(e)}
+
+    def _cache_lookup(self, video_id):
+        """Return (generation, info) from the shared cache, or None"""
+        try:
+            with stage('cache'):
+                return self.coordination.cache_get(f"info:{video_id}")
+        except Exception as e:
+            # A broken cache must never break extraction
+            logging.warning(f"Video info cache unavailable: {str(e)}")
+            return None
+
+    def _slot(self, lane):
+        """Scheduler slot for lane, or nothing when the caller already holds one"""
+        return self.scheduler.slot(lane) if lane else nullcontext()
+
+    def _check_known_failure(self, video_id):
+        """Fail instantly if this video failed recently and is still backing off
+
+        Returns the remembered failure (or None) so the next failure can extend
+        the backoff.
+        """
+        if not video_id:
+            return None
+        try:
+            entry = self.coordination.cache_get(f"fail:{video_id}")
+        except Exception as e:
+            logging.warning(f"Failure cache unavailable: {str(e)}")
+            return None
+        if not entry:
+            return None
+        failure = entry[1]
+        remaining = failure['retry_at'] - time.time()
+        if remaining > 0:
+            error = ExtractionError(failure['kind'], failure['message'], detail='cached')
+            error.retry_after = int(remaining) + 1
+            raise error
+        return failure
+
+    def _remember_failure(self, video_id, error, previous=None):
+        """Cache a classified failure for its class TTL, backing off on repeats"""
+        if not video_id or error.kind not in FAILURE_TTLS:
+            return
+        count = previous['count'] + 1 if previous and previous['kind'] == error.kind else 1
+        ttl = failure_ttl(error.kind, count)
+        error.retry_after = ttl
+        failure = {'kind': error.kind, 'message': str(error), 'count': count, 'retry_at': time.time() + ttl}
+        try:
+            # Kept beyond retry_at so the next failure still sees the count
+            self.coordination.cache_set(f"fail:{video_id}", failure, ttl * 4)
+        except Exception as e:
+            logging.warning(f"Could not cache failure: {str(e)}")
+
+    def _fail_fast(self, error):
+        """Stop trying further profiles when no other attempt can succeed"""
+        kind = classify_failure(error)
+        if kind in PERMANENT_FAILURES:
+            raise ExtractionError(kind, detail=str(error)) from error
+
+    def _build_formats(self, info):
+        """Build the list of playable formats from a yt-dlp info dict"""
+        formats = []
+        for f in info.get('formats') or []:
+            if f.get('vcodec') != 'none' or f.get('acodec') != 'none':
+                formats.append({
+                    'format_id': f.get('format_id', ''),
+                    'ext': f.get('ext', ''),
+                    'resolution': f.get('resolution', 'unknown'),
+                    'filesize': f.get('filesize'),
+                    'vcodec': f.get('vcodec', 'none'),
+                    'acodec': f.get('acodec', 'none')
+                })
+        return formats
+
+    def _extract_video_info(self, url):
         """Get video information using yt-dlp with anti-bot measures"""
         try:
             # Method 1: Try with cookie file (most effective)
@@ -79,32 +271,21 @@ class YouTubeService:
             
             try:
                 with yt_dlp.YoutubeDL(cookie_opts) as ydl:
-                    info = ydl.extract_info(url, download=False)
+                    with stage('extract.cookies'):
+                        info = ydl.extract_info(url, download=False)
                     if info:
                         # Process successful extraction
-                        formats = []
-                        if 'formats' in info:
-                            for f in info['formats']:
-                                if f.get('vcodec') != 'none' or f.get('acodec') != 'none':
-                                    format_info = {
-                                        'format_id': f.get('format_id', ''),
-                                        'ext': f.get('ext', ''),
-                                        'resolution': f.get('resolution', 'unknown'),
-                                        'filesize': f.get('filesize'),
-                                        'vcodec': f.get('vcodec', 'none'),
-                                        'acodec': f.get('acodec', 'none')
-                                    }
-                                    formats.append(format_info)
-                        
                         return {
+                            'id': info.get('id'),
                             'title': info.get('title', 'Unknown'),
                             'duration': info.get('duration', 0),
                             'thumbnail': info.get('thumbnail', ''),
-                            'formats': formats[:10],  # Limit to first 10 formats
+                            'formats': self._build_formats(info),
                             'uploader': info.get('uploader', 'Unknown')
                         }
             except Exception as cookie_error:
                 logging.info(f"Cookie file failed, trying fallback: {str(cookie_error)}")
+                self._fail_fast(cookie_error)
                 
             # Method 2: Fallback without cookies (enhanced anti-detection)
             ydl_opts = {
@@ -142,36 +323,26 @@ class YouTubeService:
             }
             
             with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=False)
+                with stage('extract.default'):
+                    info = ydl.extract_info(url, download=False)
                 
                 if not info:
                     raise Exception("No video information found")
                 
-                # Extract available formats
-                formats = []
-                if 'formats' in info:
-                    for f in info['formats']:
-                        if f.get('vcodec') != 'none' or f.get('acodec') != 'none':
-                            format_info = {
-                                'format_id': f.get('format_id', ''),
-                                'ext': f.get('ext', ''),
-                                'resolution': f.get('resolution', 'unknown'),
-                                'filesize': f.get('filesize'),
-                                'vcodec': f.get('vcodec', 'none'),
-                                'acodec': f.get('acodec', 'none')
-                            }
-                            formats.append(format_info)
-                
                 return {
+                    'id': info.get('id'),
                     'title': info.get('title', 'Unknown'),
                     'duration': info.get('duration', 0),
                     'thumbnail': info.get('thumbnail', ''),
-                    'formats': formats[:10],  # Limit to first 10 formats
+                    'formats': self._build_formats(info),
                     'uploader': info.get('uploader', 'Unknown')
                 }
                 
+        except ExtractionError:
+            raise
         except Exception as e:
             logging.error(f"Primary extraction failed: {str(e)}")
+            self._fail_fast(e)
             
             # Fallback method 1: Use yt-dlp with cookies simulation
             try:
@@ -188,9 +359,11 @@ class YouTubeService:
                 }
                 
                 with yt_dlp.YoutubeDL(fallback_opts) as ydl:
-                    info = ydl.extract_info(url, download=False)
+                    with stage('extract.fallback'):
+                        info = ydl.extract_info(url, download=False)
                     if info:
                         return {
+                            'id': info.get('id'),
                             'title': info.get('title', 'Unknown'),
                             'duration': info.get('duration', 0),
                             'thumbnail': info.get('thumbnail', ''),
@@ -199,6 +372,7 @@ class YouTubeService:
                         }
             except Exception as fallback_error:
                 logging.error(f"Fallback method 1 failed: {str(fallback_error)}")
+                self._fail_fast(fallback_error)
             
             # Fallback method 2: Minimal extraction
             try:
@@ -210,9 +384,11 @@ class YouTubeService:
                 }
                 
                 with yt_dlp.YoutubeDL(minimal_opts) as ydl:
-                    info = ydl.extract_info(url, download=False)
+                    with stage('extract.minimal'):
+                        info = ydl.extract_info(url, download=False)
                     if info:
                         return {
+                            'id': info.get('id'),
                             'title': info.get('title', 'Video'),
                             'duration': info.get('duration', 0),
                             'thumbnail': info.get('thumbnail', ''),
@@ -221,14 +397,92 @@ class YouTubeService:
                         }
             except Exception as minimal_error:
                 logging.error(f"Minimal extraction failed: {str(minimal_error)}")
+                self._fail_fast(minimal_error)
             
-            # If all methods fail, return a generic error
-            if "Sign in to confirm you're not a bot" in str(e) or "bot" in str(e).lower():
-                raise Exception("YouTube is blocking automated requests. Please try again later or use a different video.")
-            else:
-                raise Exception(f"Could not extract video information: {str(e)}")
+            # If all methods fail, report the classified primary error
+            kind = classify_failure(e)
+            if kind == UNKNOWN:
+                raise ExtractionError(kind, f"Could not extract video information: {str(e)}", detail=str(e))
+            raise ExtractionError(kind, detail=str(e))
     
-    def download_video_direct(self, url, format_type='mp4', quality='best'):
+    def get_mux_formats(self, url, quality='best', lane='bulk'):
+        """Pick the best separate video-only and audio-only streams for muxing
+
+        Returns {'title', 'video', 'audio'} with direct media URLs and request
+        headers, or None when the video has no separate streams to combine.
+        lane=None means the caller already holds a scheduler slot.
+        """
+        video_id = self.extract_video_id(url)
+        self._check_known_failure(video_id)
+
+        # Quality values look like 'best', '720p' or '1080p60'
+        height = re.search(r'(\d{3,4})', quality or '')
+        limit = f'[height<={height.group(1)}]' if height else ''
+        mux_opts = {
+            'format': f'(bestvideo{limit}[ext=mp4]/bestvideo{limit})+(bestaudio[ext=m4a]/bestaudio)',
+            'quiet': True,
+            'no_warnings': True,
+            'cookiefile': 'cookies.txt',  # Use cookie file
+            'user_agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+            'extractor_args': {
+                'youtube': {
+                    # DASH is what provides the separate high resolution streams
+                    'skip': ['hls'],
+                    'player_client': ['android', 'web']
+                }
+            }
+        }
+
+        with self._slot(lane):
+            try:
+                with yt_dlp.YoutubeDL(mux_opts) as ydl:
+                    with stage('mux.extract'):
+                        info = ydl.extract_info(url, download=False)
+            except Exception as e:
+                logging.info(f"Mux format selection failed, using progressive download: {str(e)}")
+                try:
+                    self._fail_fast(e)
+                except ExtractionError as error:
+                    self._remember_failure(video_id, error)
+                    raise
+                return None
+
+        requested = (info or {}).get('requested_formats') or []
+        video = next((f for f in requested if f.get('vcodec') not in (None, 'none')), None)
+        audio = next((f for f in requested if f.get('vcodec') in (None, 'none') and f.get('acodec') != 'none'), None)
+        if not video or not audio:
+            return None
+
+        def stream_info(f):
+            return {
+                'format_id': f.get('format_id'),
+                'url': f.get('url'),
+                'http_headers': f.get('http_headers') or {},
+                'filesize': f.get('filesize')
+            }
+
+        return {
+            'title': info.get('title', 'video'),
+            'height': video.get('height'),
+            'video': stream_info(video),
+            'audio': stream_info(audio)
+        }
+
+    def download_video_direct(self, url, format_type='mp4', quality='best', lane='bulk'):
+        """Download video directly, failing fast for videos known to be unavailable
+
+        lane=None means the caller already holds a scheduler slot.
+        """
+        video_id = self.extract_video_id(url)
+        previous_failure = self._check_known_failure(video_id)
+        try:
+            with self._slot(lane):
+                return self._download_video(url, format_type, quality)
+        except ExtractionError as e:
+            self._remember_failure(video_id, e, previous_failure)
+            raise
+
+    def _download_video(self, url, format_type='mp4', quality='best'):
         """Download video directly and return file path with anti-bot measures"""
         try:
             # Create temporary directory for downloads
@@ -236,7 +490,7 @@ class YouTubeService:
             
             # Try with cookie file first
             cookie_opts = {
-                'format': 'best[ext=mp4]/best' if format_type == 'mp4' else 'bestaudio[ext=m4a]/best[ext=m4a]/bestaudio',
+                'format': 'best[ext=mp4]/best' if is_video_format(format_type) else 'bestaudio[ext=m4a]/best[ext=m4a]/bestaudio',
                 'outtmpl': os.path.join(download_dir, '%(title)s.%(ext)s'),
                 'quiet': True,
                 'no_warnings': True,
@@ -266,66 +520,71 @@ class YouTubeService:
                 }
             }
             
-            try:
-                with yt_dlp.YoutubeDL(cookie_opts) as ydl:
-                    ydl.download([url])
-            except Exception as cookie_error:
-                logging.info(f"Cookie file download failed, trying fallback: {str(cookie_error)}")
-                
-                # Fallback: Configure download options without cookies
-                ydl_opts = {
-                    'format': 'best[ext=mp4]/best' if format_type == 'mp4' else 'bestaudio[ext=m4a]/best[ext=m4a]/bestaudio',
-                    'outtmpl': os.path.join(download_dir, '%(title)s.%(ext)s'),
-                    'quiet': True,
-                    'no_warnings': True,
-                    'user_agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-                    'http_headers': {
-                        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-                        'Accept-Language': 'en-US,en;q=0.9',
-                        'Accept-Encoding': 'gzip, deflate, br',
-                        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,image/apng,*/*;q=0.8',
-                        'Connection': 'keep-alive',
-                        'Upgrade-Insecure-Requests': '1',
-                        'Sec-Fetch-Dest': 'document',
-                        'Sec-Fetch-Mode': 'navigate',
-                        'Sec-Fetch-Site': 'none',
-                        'Sec-Fetch-User': '?1',
-                        'Cache-Control': 'max-age=0',
-                        'DNT': '1',
-                        'Sec-GPC': '1'
-                    },
-                    'extractor_args': {
-                        'youtube': {
-                            'skip': ['dash', 'hls'],
-                            'player_client': ['android', 'web'],
-                            'player_skip': ['configs', 'webpage']
+            # Fallback: Configure download options without cookies
+            ydl_opts = {
+                'format': 'best[ext=mp4]/best' if is_video_format(format_type) else 'bestaudio[ext=m4a]/best[ext=m4a]/bestaudio',
+                'outtmpl': os.path.join(download_dir, '%(title)s.%(ext)s'),
+                'quiet': True,
+                'no_warnings': True,
+                'user_agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+                'http_headers': {
+                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+                    'Accept-Language': 'en-US,en;q=0.9',
+                    'Accept-Encoding': 'gzip, deflate, br',
+                    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,image/apng,*/*;q=0.8',
+                    'Connection': 'keep-alive',
+                    'Upgrade-Insecure-Requests': '1',
+                    'Sec-Fetch-Dest': 'document',
+                    'Sec-Fetch-Mode': 'navigate',
+                    'Sec-Fetch-Site': 'none',
+                    'Sec-Fetch-User': '?1',
+                    'Cache-Control': 'max-age=0',
+                    'DNT': '1',
+                    'Sec-GPC': '1'
+                },
+                'extractor_args': {
+                    'youtube': {
+                        'skip': ['dash', 'hls'],
+                        'player_client': ['android', 'web'],
+                        'player_skip': ['configs', 'webpage']
                     }
                 }
             }
             
-            try:
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    ydl.download([url])
-            except Exception as primary_error:
-                logging.error(f"Primary download failed: {str(primary_error)}")
-                
-                # Fallback download method
-                fallback_opts = {
-                    'format': 'worst[ext=mp4]/worst' if format_type == 'mp4' else 'worstaudio',
-                    'outtmpl': os.path.join(download_dir, '%(title)s.%(ext)s'),
-                    'quiet': True,
-                    'no_warnings': True,
-                    'user_agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-                    'extractor_args': {
-                        'youtube': {
-                            'skip': ['dash'],
-                            'player_client': ['android', 'web']
-                        }
+            # Fallback download method
+            fallback_opts = {
+                'format': 'worst[ext=mp4]/worst' if is_video_format(format_type) else 'worstaudio',
+                'outtmpl': os.path.join(download_dir, '%(title)s.%(ext)s'),
+                'quiet': True,
+                'no_warnings': True,
+                'user_agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+                'extractor_args': {
+                    'youtube': {
+                        'skip': ['dash'],
+                        'player_client': ['android', 'web']
                     }
                 }
-                
-                with yt_dlp.YoutubeDL(fallback_opts) as ydl:
-                    ydl.download([url])
+            }
+            
+            attempts = [
+                ('download.cookies', cookie_opts),
+                ('download.default', ydl_opts),
+                ('download.fallback', fallback_opts)
+            ]
+            for attempt, (stage_name, opts) in enumerate(attempts, 1):
+                try:
+                    with yt_dlp.YoutubeDL(opts) as ydl:
+                        with stage(stage_name):
+                            ydl.download([url])
+                    break
+                except Exception as attempt_error:
+                    logging.info(f"Download attempt {stage_name} failed: {str(attempt_error)}")
+                    self._fail_fast(attempt_error)
+                    if attempt == len(attempts):
+                        raise
+                    # Drop partial files before the next attempt
+                    shutil.rmtree(download_dir, ignore_errors=True)
+                    os.makedirs(download_dir, exist_ok=True)
             
             # Find the downloaded file
             files = os.listdir(download_dir)
@@ -339,12 +598,14 @@ class YouTubeService:
             
             return downloaded_file
             
+        except ExtractionError:
+            raise
         except Exception as e:
             logging.error(f"Download error: {str(e)}")
-            if "Sign in to confirm you're not a bot" in str(e) or "bot" in str(e).lower():
-                raise Exception("YouTube is blocking automated requests. Please try again later.")
-            else:
-                raise Exception(f"Download failed: {str(e)}")
+            kind = classify_failure(e)
+            if kind == UNKNOWN:
+                raise ExtractionError(kind, f"Download failed: {str(e)}", detail=str(e))
+            raise ExtractionError(kind, detail=str(e))
 
     def _format_duration(self, duration):
         """Format duration from seconds to MM:SS or HH:MM:SS"""